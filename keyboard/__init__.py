@@ -86,7 +86,7 @@ python -m keyboard < events.txt
 
 - Events generated under Windows don't report device id (`event.device == None`). [#21](https://github.com/boppreh/keyboard/issues/21)
 - Media keys on Linux may appear nameless (scan-code only) or not at all. [#20](https://github.com/boppreh/keyboard/issues/20)
-- Key suppression/blocking only available on Windows. [#22](https://github.com/boppreh/keyboard/issues/22)
+- Key suppression/blocking only available on Windows, or on Linux after calling `set_exclusive_grab()`. [#22](https://github.com/boppreh/keyboard/issues/22)
 - To avoid depending on X, the Linux parts reads raw device files (`/dev/input/input*`) but this requires root.
 - Other applications, such as some games, may register hooks that swallow all key events. In this case `keyboard` will be unable to report events.
 - This program makes no attempt to hide itself, so don't use it for keyloggers or online gaming bots. Be responsible.
@@ -198,7 +198,10 @@ version = '0.13.5'
 import re as _re
 import itertools as _itertools
 import collections as _collections
-from threading import Thread as _Thread, Lock as _Lock
+import heapq as _heapq
+import atexit as _atexit
+import traceback as _traceback
+from threading import Thread as _Thread, Lock as _Lock, RLock as _RLock, Condition as _Condition, local as _local
 import time as _time
 # Python2... Buggy on time changes and leap seconds, but no other good option (https://stackoverflow.com/questions/1205722/how-do-i-get-monotonic-time-durations-in-python).
 _time.monotonic = getattr(_time, 'monotonic', None) or _time.time
@@ -231,6 +234,140 @@ class _Event(_UninterruptibleEvent):
             if _UninterruptibleEvent.wait(self, 0.5):
                 break
 
+class _Scheduler(object):
+    """
+    Calls functions at given times, on the `_time.monotonic` clock, from a
+    single daemon thread that sleeps until the earliest one is due. The
+    thread is only started when something is scheduled.
+
+    Timers run on the scheduler thread and must be quick. Slower work is
+    handed to `submit`, which runs it on a pool of at most `max_workers`
+    reusable threads.
+
+    The threads are daemons, so timers don't keep the program alive. Calls
+    made with `call_later` are the exception: `drain` waits for them, and is
+    registered to run at exit.
+    """
+    max_workers = 4
+
+    def __init__(self):
+        self.condition = _Condition(_Lock())
+        # Heap of [time, unique id, function, args, counted in `pending`].
+        # Cancelled and fired timers have their function replaced by None.
+        self.timers = []
+        self.count = 0
+        # Number of `call_later` calls not finished yet.
+        self.pending = 0
+        self.thread = None
+        self.tasks = _queue.Queue()
+        self.workers = 0
+        self.idle_workers = 0
+
+    def schedule(self, when, fn, args=(), pending=False):
+        """
+        Calls `fn(*args)` at time `when`. Returns a handle for `cancel`.
+        """
+        with self.condition:
+            self.count += 1
+            timer = [when, self.count, fn, args, pending]
+            _heapq.heappush(self.timers, timer)
+            if self.thread is None:
+                self.thread = _Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            elif self.timers[0] is timer:
+                # `drain` may be waiting on the same condition.
+                self.condition.notify_all()
+        return timer
+
+    def cancel(self, timer):
+        with self.condition:
+            if timer[2] is not None and timer[4]:
+                self.finish_pending()
+            timer[2] = None
+
+    def call_later(self, when, fn, args=()):
+        """
+        Calls `fn(*args)` on a worker thread at time `when`. Returns a handle
+        for `cancel`. Unlike other timers, these calls are waited for by
+        `drain`.
+        """
+        with self.condition:
+            self.pending += 1
+        return self.schedule(when, self.submit, (self.run_pending, (fn, args)), pending=True)
+
+    def run_pending(self, fn, args):
+        try:
+            fn(*args)
+        finally:
+            with self.condition:
+                self.finish_pending()
+
+    def finish_pending(self):
+        # Called with the condition held.
+        self.pending -= 1
+        self.condition.notify_all()
+
+    def drain(self):
+        """
+        Waits until all `call_later` calls have finished or were cancelled,
+        including the ones they schedule.
+        """
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.timers or self.timers[0][0] > _time.monotonic():
+                    # Don't wake up for cancelled timers.
+                    while self.timers and self.timers[0][2] is None:
+                        _heapq.heappop(self.timers)
+                    if self.timers:
+                        self.condition.wait(self.timers[0][0] - _time.monotonic())
+                    else:
+                        self.condition.wait()
+                timer = _heapq.heappop(self.timers)
+                fn, args = timer[2], timer[3]
+                timer[2] = None
+            if fn is not None:
+                try:
+                    fn(*args)
+                except Exception:
+                    _traceback.print_exc()
+
+    def submit(self, fn, args=()):
+        """
+        Calls `fn(*args)` on a worker thread. A new worker is started only if
+        all are busy and there are fewer than `max_workers`, otherwise the
+        call waits for the next free one.
+        """
+        self.tasks.put((fn, args))
+        with self.condition:
+            if self.idle_workers or self.workers >= self.max_workers:
+                return
+            self.workers += 1
+        thread = _Thread(target=self.work)
+        thread.daemon = True
+        thread.start()
+
+    def work(self):
+        while True:
+            with self.condition:
+                self.idle_workers += 1
+            fn, args = self.tasks.get()
+            with self.condition:
+                self.idle_workers -= 1
+            try:
+                fn(*args)
+            except Exception:
+                _traceback.print_exc()
+
+_scheduler = _Scheduler()
+# Like the thread per call used before, pending `call_later` calls delay exit.
+_atexit.register(_scheduler.drain)
+
 import platform as _platform
 if _platform.system() == 'Windows':
     from. import _winkeyboard as _os_keyboard
@@ -245,10 +382,27 @@ elif _platform.system() == 'Darwin':
 else:
     raise OSError("Unsupported platform '{}'".format(_platform.system()))
 
-from ._keyboard_event import KEY_DOWN, KEY_UP, KeyboardEvent
+from ._keyboard_event import KEY_DOWN, KEY_UP, REPEAT_PASS, REPEAT_DROP, REPEAT_SINGLE, KeyboardEvent
 from ._generic import GenericListener as _GenericListener
 from ._canonical_names import all_modifiers, sided_modifiers, normalize_name
 
+class _NoBatch(object):
+    """ Used for backends that send each key event immediately. """
+    def __enter__(self): return self
+    def __exit__(self, *args): pass
+    def flush(self): pass
+
+def _batch():
+    """
+    Groups the OS events sent inside a `with` block into as few system calls as
+    the backend allows (e.g. a single `write` to uinput on Linux). The value
+    returned by entering the block has a `flush` method to send the events
+    collected so far.
+    """
+    if hasattr(_os_keyboard, 'batch'):
+        return _os_keyboard.batch()
+    return _NoBatch()
+
 _modifier_scan_codes = set()
 def is_modifier(key):
     """
@@ -262,8 +416,288 @@ def is_modifier(key):
             _modifier_scan_codes.update(*scan_codes)
         return key in _modifier_scan_codes
 
+class _HotkeyTable(object):
+    """
+    Single-step hotkeys (e.g. 'ctrl+shift+a') and their handlers, looked up by
+    the sorted tuple of pressed scan codes.
+
+    Each key of a step is a class, the set of scan codes that stand for it
+    (e.g. left and right shift), with its own bit. A step is stored once, as
+    the mask of its classes and its number of keys, and matches when the
+    pressed keys are one member of each class. So 'ctrl+alt+shift+windows+x'
+    is a single entry, not one for each combination of sides.
+
+    Changes come from the user's threads and lookups from the listener, so
+    both changes and cache misses hold `lock`. Cache hits don't need it, and
+    cached handler lists are never modified.
+    """
+    # Pressed states remembered between changes to the table.
+    max_cache_size = 1000
+
+    def __init__(self):
+        self.lock = _Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def _clear(self):
+        # (mask, number of keys) -> (scan codes of the indexed key, handlers).
+        self.steps = {}
+        # Scan code -> steps whose indexed key includes it. The main key is
+        # indexed, not a modifier shared by many hotkeys.
+        self.steps_by_scan_code = _collections.defaultdict(list)
+        # Frozenset of scan codes -> bit of that class.
+        self.class_bits = {}
+        # Scan code -> bits of all classes that include it.
+        self.scan_code_bits = {}
+        # Tuple of pressed scan codes -> handlers of the matching steps.
+        self.cache = {}
+        # Stays set after the steps are removed, like the keys of the old
+        # defaultdict, so `modifier_states` keep being settled.
+        self.used = False
+
+    def __bool__(self):
+        return self.used
+    __nonzero__ = __bool__
+
+    def add(self, step, handler):
+        """
+        Adds a handler for the given step, a tuple of keys, each a tuple of
+        scan codes. Returns the entry to pass to `remove`.
+        """
+        with self.lock:
+            return self._add(step, handler)
+
+    def _add(self, step, handler):
+        mask = 0
+        for key in step:
+            key = frozenset(key)
+            bit = self.class_bits.get(key)
+            if bit is None:
+                bit = self.class_bits[key] = 1 << len(self.class_bits)
+                for scan_code in key:
+                    self.scan_code_bits[scan_code] = self.scan_code_bits.get(scan_code, 0) | bit
+            mask |= bit
+        entry = (mask, len(step))
+        if entry not in self.steps:
+            main_keys = [key for key in step if not all(is_modifier(scan_code) for scan_code in key)]
+            indexed_key = (main_keys or step)[-1]
+            self.steps[entry] = (indexed_key, [])
+            for scan_code in indexed_key:
+                self.steps_by_scan_code[scan_code].append(entry)
+        self.steps[entry][1].append(handler)
+        self.cache.clear()
+        self.used = True
+        return entry
+
+    def remove(self, entry, handler):
+        with self.lock:
+            indexed_key, handlers = self.steps[entry]
+            handlers.remove(handler)
+            if not handlers:
+                del self.steps[entry]
+                for scan_code in indexed_key:
+                    self.steps_by_scan_code[scan_code].remove(entry)
+            self.cache.clear()
+
+    def values(self):
+        with self.lock:
+            return [list(handlers) for indexed_key, handlers in self.steps.values()]
+
+    def __getitem__(self, scan_codes):
+        handlers = self.cache.get(scan_codes)
+        if handlers is None:
+            # Matched and stored under the lock, so a result computed before
+            # a change can't be cached after it.
+            with self.lock:
+                if len(self.cache) >= self.max_cache_size:
+                    self.cache.clear()
+                handlers = self.cache[scan_codes] = self.match(scan_codes)
+        return handlers
+
+    def match(self, scan_codes):
+        """
+        Returns the handlers of the steps matching these pressed keys. Must be
+        called with the lock held.
+        """
+        pressed_mask = 0
+        for scan_code in scan_codes:
+            bits = self.scan_code_bits.get(scan_code)
+            if not bits:
+                # Not part of any hotkey.
+                return []
+            pressed_mask |= bits
+
+        handlers = []
+        seen = []
+        for scan_code in scan_codes:
+            for entry in self.steps_by_scan_code.get(scan_code, ()):
+                mask, size = entry
+                if size != len(scan_codes) or pressed_mask & mask != mask or entry in seen:
+                    continue
+                if all(self.scan_code_bits[other] & mask for other in scan_codes):
+                    seen.append(entry)
+                    handlers.extend(self.steps[entry][1])
+        return handlers
+
+class _HotkeySequences(object):
+    """
+    Multi-step hotkeys (e.g. 'ctrl+k, ctrl+c') waiting for their next step.
+    Instead of a blocking hook per hotkey in progress, `check` is called once
+    for each event and only touches the sequences that the event breaks: a key
+    outside of their next step, or their timeout passing. The cost of an event
+    doesn't grow with the number of hotkeys in progress.
+
+    Timeouts also expire on their own, through `_scheduler`, so the suppressed
+    keys are replayed even if no other key is pressed.
+
+    Sequences are objects with a `fail()` method, called (outside the lock)
+    to reset them. It may be called from the scheduler thread, after the
+    sequence was already advanced on the listener thread, so it must check
+    `is_waiting` under the sequence's own lock.
+    """
+    def __init__(self):
+        self.lock = _Lock()
+        self.timer = None
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # Event type that advances the sequence -> {sequence: allowed scan codes}.
+            self.waiting = {KEY_DOWN: {}, KEY_UP: {}}
+            # (event type, scan code) -> sequences whose next step allows it.
+            self.allowing = _collections.defaultdict(set)
+            # Heap of (deadline, unique id, sequence). Entries whose deadline no
+            # longer matches `deadline_by_sequence` are stale and skipped.
+            self.deadlines = []
+            self.deadline_by_sequence = {}
+            self.count = 0
+            # Time of the last event seen, on the `_event_time` clock, and
+            # on `_time.monotonic` when it was seen.
+            self.event_time = self.event_clock = None
+            if self.timer is not None:
+                _scheduler.cancel(self.timer)
+                self.timer = None
+
+    def __bool__(self):
+        return bool(self.waiting[KEY_DOWN] or self.waiting[KEY_UP])
+    __nonzero__ = __bool__
+
+    def now(self):
+        """
+        Current time on the `_event_time` clock. With event timestamps it's
+        extrapolated from the last event, so sequences don't expire early
+        just because the listener is running behind.
+        """
+        if _monotonic_events and self.event_time is not None:
+            return self.event_time + _time.monotonic() - self.event_clock
+        return _time.monotonic()
+
+    def wait(self, sequence, event_type, allowed, timeout=None, event=None):
+        """
+        Marks `sequence` as waiting for a step made of the `allowed` scan
+        codes, failing on other `event_type` events or `timeout` seconds after
+        `event` (or now).
+        """
+        with self.lock:
+            self._discard(sequence)
+            self.waiting[event_type][sequence] = allowed
+            for scan_code in allowed:
+                self.allowing[event_type, scan_code].add(sequence)
+            if timeout:
+                if event is None:
+                    last_update = _time.monotonic()
+                else:
+                    last_update = self.event_time = _event_time(event)
+                    self.event_clock = _time.monotonic()
+                deadline = last_update + timeout
+                self.deadline_by_sequence[sequence] = deadline
+                self.count += 1
+                _heapq.heappush(self.deadlines, (deadline, self.count, sequence))
+                self._schedule()
+
+    def discard(self, sequence):
+        with self.lock:
+            self._discard(sequence)
+
+    def is_waiting(self, sequence):
+        with self.lock:
+            return any(sequence in waiting for waiting in self.waiting.values())
+
+    def _discard(self, sequence):
+        for event_type, waiting in self.waiting.items():
+            allowed = waiting.pop(sequence, None)
+            if allowed is None:
+                continue
+            for scan_code in allowed:
+                sequences = self.allowing[event_type, scan_code]
+                sequences.discard(sequence)
+                if not sequences:
+                    del self.allowing[event_type, scan_code]
+        self.deadline_by_sequence.pop(sequence, None)
+
+    def _pop_expired(self, now):
+        expired = []
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, _, sequence = _heapq.heappop(self.deadlines)
+            if self.deadline_by_sequence.get(sequence) == deadline:
+                self._discard(sequence)
+                expired.append(sequence)
+        return expired
+
+    def _schedule(self):
+        # Keeps a single timer, for the earliest deadline still current.
+        while self.deadlines and self.deadline_by_sequence.get(self.deadlines[0][2]) != self.deadlines[0][0]:
+            _heapq.heappop(self.deadlines)
+        if not self.deadlines:
+            return
+        deadline = self.deadlines[0][0]
+        if self.timer is not None:
+            if self.timer[0] <= _time.monotonic() + deadline - self.now():
+                return
+            _scheduler.cancel(self.timer)
+        self.timer = _scheduler.schedule(_time.monotonic() + deadline - self.now(), self.expire)
+
+    def expire(self):
+        """ Fails the sequences whose timeout passed. Called by `_scheduler`. """
+        with self.lock:
+            self.timer = None
+            failed = self._pop_expired(self.now())
+            self._schedule()
+        for sequence in failed:
+            sequence.fail()
+
+    def check(self, event):
+        """ Fails the sequences broken by this event. """
+        with self.lock:
+            failed = []
+            if self.deadlines:
+                failed = self._pop_expired(_event_time(event))
+            if _monotonic_events:
+                self.event_time = event.time
+                self.event_clock = _time.monotonic()
+
+            waiting = self.waiting[event.event_type]
+            allowing = self.allowing.get((event.event_type, event.scan_code), ())
+            if len(allowing) != len(waiting):
+                # Every sequence failed here is reset, so this is paid once
+                # per step taken.
+                broken = [sequence for sequence in waiting if sequence not in allowing]
+                for sequence in broken:
+                    self._discard(sequence)
+                failed.extend(broken)
+
+        for sequence in failed:
+            sequence.fail()
+
 _pressed_events_lock = _Lock()
 _pressed_events = {}
+# Sorted tuple of the scan codes in `_pressed_events`, the key used by the
+# hotkey tables. Replaced (never mutated) only when a key is pressed or
+# released, so it can be read without the lock.
+_pressed_scan_codes = ()
 _physically_pressed_keys = _pressed_events
 _logically_pressed_keys = {}
 class _KeyboardListener(_GenericListener):
@@ -314,25 +748,52 @@ class _KeyboardListener(_GenericListener):
         _os_keyboard.init()
 
         self.active_modifiers = set()
-        self.blocking_hooks = []
+        # Hooks by the event type they receive, and key hooks by (event type,
+        # scan code), so events only reach the hooks interested in them.
+        self.blocking_hooks = {KEY_DOWN: [], KEY_UP: []}
         self.blocking_keys = _collections.defaultdict(list)
         self.nonblocking_keys = _collections.defaultdict(list)
-        self.blocking_hotkeys = _collections.defaultdict(list)
-        self.nonblocking_hotkeys = _collections.defaultdict(list)
+        self.blocking_hotkeys = _HotkeyTable()
+        self.nonblocking_hotkeys = _HotkeyTable()
+        self.hotkey_sequences = _HotkeySequences()
         self.filtered_modifiers = _collections.Counter()
         self.is_replaying = False
+        # Set only on the thread replaying suppressed keys, see `_replay`.
+        self.replaying = _local()
 
         # Supporting hotkey suppression is harder than it looks. See
         # https://github.com/boppreh/keyboard/issues/22
         self.modifier_states = {} # "alt" -> "allowed"
 
+        # Start from the keys already held down, if the OS can tell us, so
+        # hotkeys and `is_pressed` work even if a key was pressed before the
+        # program started.
+        if hasattr(_os_keyboard, 'get_pressed_events'):
+            self.seed_pressed_events(_os_keyboard.get_pressed_events())
+
+    def seed_pressed_events(self, events):
+        """
+        Replaces the tables of currently pressed keys with the given KEY_DOWN
+        events, without invoking any hooks.
+        """
+        global _pressed_scan_codes
+        with _pressed_events_lock:
+            _pressed_events.clear()
+            _logically_pressed_keys.clear()
+            self.active_modifiers.clear()
+            for event in events:
+                _pressed_events[event.scan_code] = event
+                _logically_pressed_keys[event.scan_code] = event
+            _pressed_scan_codes = tuple(sorted(_pressed_events))
+        for scan_code in list(_logically_pressed_keys):
+            if is_modifier(scan_code):
+                self.active_modifiers.add(scan_code)
+
     def pre_process_event(self, event):
-        for key_hook in self.nonblocking_keys[event.scan_code]:
+        for key_hook in self.nonblocking_keys[event.event_type, event.scan_code]:
             key_hook(event)
 
-        with _pressed_events_lock:
-            hotkey = tuple(sorted(_pressed_events))
-        for callback in self.nonblocking_hotkeys[hotkey]:
+        for callback in self.nonblocking_hotkeys[_pressed_scan_codes]:
             callback(event)
 
         return event.scan_code or (event.name and event.name != 'unknown')
@@ -348,27 +809,39 @@ class _KeyboardListener(_GenericListener):
         suppress specific hotkeys.
         """
         # Pass through all fake key events, don't even report to other handlers.
-        if self.is_replaying:
+        if self.is_replaying or getattr(self.replaying, 'active', False):
             return True
 
-        if not all(hook(event) for hook in self.blocking_hooks):
-            return False
+        if self.hotkey_sequences:
+            self.hotkey_sequences.check(event)
 
         event_type = event.event_type
         scan_code = event.scan_code
 
-        # Update tables of currently pressed keys and modifiers.
-        with _pressed_events_lock:
-            if event_type == KEY_DOWN:
-                if is_modifier(scan_code): self.active_modifiers.add(scan_code)
+        if not all(hook(event) for hook in self.blocking_hooks[event_type]):
+            return False
+
+        # Update tables of currently pressed keys and modifiers. The lock is
+        # only needed when keys are added or removed, not for repeats.
+        global _pressed_scan_codes
+        if event_type == KEY_DOWN:
+            if is_modifier(scan_code): self.active_modifiers.add(scan_code)
+            if scan_code in _pressed_events:
                 _pressed_events[scan_code] = event
-            hotkey = tuple(sorted(_pressed_events))
-            if event_type == KEY_UP:
-                self.active_modifiers.discard(scan_code)
-                if scan_code in _pressed_events: del _pressed_events[scan_code]
+            else:
+                with _pressed_events_lock:
+                    _pressed_events[scan_code] = event
+                    _pressed_scan_codes = tuple(sorted(_pressed_scan_codes + (scan_code,)))
+        hotkey = _pressed_scan_codes
+        if event_type == KEY_UP:
+            self.active_modifiers.discard(scan_code)
+            if scan_code in _pressed_events:
+                with _pressed_events_lock:
+                    del _pressed_events[scan_code]
+                    _pressed_scan_codes = tuple(c for c in hotkey if c != scan_code)
 
         # Mappings based on individual keys instead of hotkeys.
-        for key_hook in self.blocking_keys[scan_code]:
+        for key_hook in self.blocking_keys[event_type, scan_code]:
             if not key_hook(event):
                 return False
 
@@ -403,8 +876,11 @@ class _KeyboardListener(_GenericListener):
             elif event_type == KEY_UP and scan_code in _logically_pressed_keys:
                 del _logically_pressed_keys[scan_code]
 
-        # Queue for handlers that won't block the event.
-        self.queue.put(event)
+        # Queue for handlers that won't block the event, if any could be
+        # interested in it. Hook filters are checked here, so events they
+        # reject are not queued.
+        if self.nonblocking_hotkeys.steps or self.nonblocking_keys.get((event_type, scan_code)) or self.wants(event):
+            self.queue.put(event)
 
         return accept
 
@@ -495,14 +971,15 @@ def send(hotkey, do_press=True, do_release=True):
     _listener.is_replaying = True
 
     parsed = parse_hotkey(hotkey)
-    for step in parsed:
-        if do_press:
-            for scan_codes in step:
-                _os_keyboard.press(scan_codes[0])
+    with _batch():
+        for step in parsed:
+            if do_press:
+                for scan_codes in step:
+                    _os_keyboard.press(scan_codes[0])
 
-        if do_release:
-            for scan_codes in reversed(step):
-                _os_keyboard.release(scan_codes[0])
+            if do_release:
+                for scan_codes in reversed(step):
+                    _os_keyboard.release(scan_codes[0])
 
     _listener.is_replaying = False
 
@@ -529,16 +1006,13 @@ def is_pressed(hotkey):
 
     if _is_number(hotkey):
         # Shortcut.
-        with _pressed_events_lock:
-            return hotkey in _pressed_events
+        return hotkey in _pressed_scan_codes
 
     steps = parse_hotkey(hotkey)
     if len(steps) > 1:
         raise ValueError("Impossible to check if multi-step hotkeys are pressed (`a+b` is ok, `a, b` isn't).")
 
-    # Convert _pressed_events into a set 
-    with _pressed_events_lock:
-        pressed_scan_codes = set(_pressed_events)
+    pressed_scan_codes = set(_pressed_scan_codes)
     for scan_codes in steps[0]:
         if not any(scan_code in pressed_scan_codes for scan_code in scan_codes):
             return False
@@ -546,15 +1020,26 @@ def is_pressed(hotkey):
 
 def call_later(fn, args=(), delay=0.001):
     """
-    Calls the provided function in a new thread after waiting some time.
+    Calls the provided function in a background thread after waiting some time.
     Useful for giving the system some time to process an event, without blocking
     the current execution flow.
+
+    Calls are timed by a single shared thread and run on a small pool of
+    reusable threads, so a callback that blocks for long delays the others.
+    The program waits for pending calls before exiting.
+
+    Returns a handle that can be given to `cancel_call_later`.
     """
-    thread = _Thread(target=lambda: (_time.sleep(delay), fn(*args)))
-    thread.start()
+    return _scheduler.call_later(_time.monotonic() + delay, fn, args)
+
+def cancel_call_later(handle):
+    """
+    Cancels a call scheduled with `call_later`, if it hasn't started yet.
+    """
+    _scheduler.cancel(handle)
 
 _hooks = {}
-def hook(callback, suppress=False, on_remove=lambda: None):
+def hook(callback, suppress=False, on_remove=lambda: None, filter=None):
     """
     Installs a global listener on all available keyboards, invoking `callback`
     each time a key is pressed or released.
@@ -567,35 +1052,210 @@ def hook(callback, suppress=False, on_remove=lambda: None):
     - `scan_code`: number representing the physical key, e.g. 55.
     - `time`: timestamp of the time the event occurred, with as much precision
     as given by the OS.
+    - `is_repeat`: True if generated by holding the key down (Linux only, see
+    `set_repeat_policy`).
+
+    `filter` is an optional dict restricting the events that reach the
+    callback, with any of the fields:
+
+    - `event_types`: KEY_DOWN, KEY_UP or a list of them.
+    - `scan_codes`: a scan code or a list of them (numbers, use `names` for
+    key names).
+    - `names`: a key name or a list of them, compared with `event.name`.
+    - `devices`: a device id or a list of them, compared with `event.device`.
+    - `exclude_repeat`: if true, events generated by holding a key down are
+    skipped.
+
+    Filters are checked by the listener before the callback is called, and
+    events no hook is interested in are not queued at all.
+
+        hook(print, filter={'event_types': KEY_DOWN, 'names': ['a', 'b']})
 
     Returns the given callback for easier development.
     """
+    if filter is None:
+        return _hook(callback, suppress, on_remove, (KEY_DOWN, KEY_UP))
+
+    event_types, scan_codes, predicate = _compile_filter(filter)
+    return _hook(callback, suppress, on_remove, event_types, scan_codes, predicate)
+
+def _all_checks(checks):
+    checks = [check for check in checks if check is not None]
+    if not checks:
+        return None
+    elif len(checks) == 1:
+        return checks[0]
+    return lambda e: all(check(e) for check in checks)
+
+_filter_fields = ('event_types', 'scan_codes', 'names', 'devices', 'exclude_repeat')
+def _compile_filter(filter):
+    """
+    Splits a `hook` filter into the event types and scan codes it accepts
+    (the latter None for any), and a predicate for the remaining fields
+    (None if there are none).
+    """
+    unknown = set(filter) - set(_filter_fields)
+    if unknown:
+        raise ValueError('Unknown filter fields {}.'.format(', '.join(sorted(unknown))))
+    as_set = lambda value: set([value]) if _is_str(value) or _is_number(value) or value is None else set(value)
+
+    event_types = (KEY_DOWN, KEY_UP)
+    if filter.get('event_types') is not None:
+        requested = as_set(filter['event_types'])
+        if requested - set(event_types):
+            raise ValueError('Unknown event types {}.'.format(repr(sorted(requested - set(event_types)))))
+        if not requested:
+            raise ValueError('Empty list of event types, the hook would never be called.')
+        event_types = tuple(event_type for event_type in event_types if event_type in requested)
+
+    scan_codes = None
+    if filter.get('scan_codes') is not None:
+        scan_codes = as_set(filter['scan_codes'])
+        if not all(_is_number(scan_code) for scan_code in scan_codes):
+            raise ValueError('Scan codes must be numbers, got {}. Use the "names" field for key names.'.format(repr(filter['scan_codes'])))
+
+    checks = []
+    if filter.get('names') is not None:
+        names = set(normalize_name(name) for name in as_set(filter['names']))
+        checks.append(lambda e: e.name in names)
+    if 'devices' in filter:
+        devices = as_set(filter['devices'])
+        checks.append(lambda e: e.device in devices)
+    if filter.get('exclude_repeat'):
+        checks.append(lambda e: not e.is_repeat)
+    return event_types, scan_codes, _all_checks(checks)
+
+def _hook(callback, suppress, on_remove, event_types, scan_codes=None, predicate=None):
     if suppress:
+        # Blocking hooks must accept what they don't match.
+        if scan_codes is not None:
+            predicate = _all_checks([predicate, lambda e: e.scan_code in scan_codes])
+        handler = callback if predicate is None else lambda e: not predicate(e) or callback(e)
         _listener.start_if_necessary()
-        append, remove = _listener.blocking_hooks.append, _listener.blocking_hooks.remove
+        hook_lists = [_listener.blocking_hooks[event_type] for event_type in event_types]
+        for hook_list in hook_lists:
+            hook_list.append(handler)
+        def remove():
+            for hook_list in hook_lists:
+                hook_list.remove(handler)
     else:
-        append, remove = _listener.add_handler, _listener.remove_handler
+        event_type = event_types[0] if len(event_types) == 1 else None
+        token = _listener.add_handler(callback, event_type, scan_codes, predicate)
+        remove = lambda: _listener.remove_token(token)
 
-    append(callback)
     def remove_():
         _hooks.pop(callback, None)
         _hooks.pop(remove_, None)
-        remove(callback)
+        remove()
         on_remove()
     _hooks[callback] = _hooks[remove_] = remove_
     return remove_
 
+def set_exclusive_grab(enabled=True):
+    """
+    On Linux, events are normally delivered to other programs before we see
+    them, so they cannot be suppressed. Enabling exclusive grab makes
+    `keyboard` the only reader of the physical keyboards, re-sending each
+    accepted event through a virtual keyboard (uinput). This makes
+    `suppress=True`, `block_key`, `remap_key` and suppressed hotkeys work.
+
+    Each keyboard is grabbed as soon as none of its keys are held down. Use
+    `set_exclusive_grab(False)` to give the keyboards back.
+
+    Note: on other platforms suppression is always available and this
+    function does nothing.
+    """
+    if hasattr(_os_keyboard, 'set_grab'):
+        _listener.start_if_necessary()
+        _os_keyboard.set_grab(enabled)
+
+def set_device_filter(include=None, exclude=None, keyboards_only=True):
+    """
+    Chooses which input devices are listened to. By default all devices that
+    can type letters are used, skipping power buttons, lid switches, webcam
+    buttons and other devices that only have a few special keys.
+
+    - `include` is a list of patterns. If given, only devices matching at
+    least one of them are used.
+    - `exclude` is a list of patterns. Devices matching any of them are not
+    used.
+    - `keyboards_only` if false, devices without letter keys are also used.
+
+    Each pattern is either a glob matched against the device name, physical
+    path and event file (e.g. 'Logitech*', 'usb-0000:00:14.0-*',
+    '/dev/input/event3'), or a function that receives the device info (with
+    attributes `name`, `phys`, `path` and `key_codes`) and returns True if it
+    matches. Can be called while listening.
+
+        set_device_filter(exclude=['Yubico*'])
+
+    Note: only available on Linux.
+    """
+    if not hasattr(_os_keyboard, 'set_device_filter'):
+        raise NotImplementedError('Device filters are only available on Linux.')
+    _os_keyboard.set_device_filter(include, exclude, keyboards_only)
+
+# Whether event timestamps come from the `_time.monotonic` clock, allowing
+# hotkey timeouts to be measured between the events themselves.
+_monotonic_events = False
+def _event_time(event):
+    return event.time if _monotonic_events else _time.monotonic()
+
+def set_monotonic_clock(enabled=True):
+    """
+    On Linux, events are timestamped by the kernel with the wall clock, which
+    jumps and slews when the system time is adjusted (e.g. by NTP), distorting
+    the timing of recordings. Enabling the monotonic clock switches all
+    keyboards to CLOCK_MONOTONIC, and `event.time` becomes comparable to
+    `time.monotonic()`.
+
+    Multi-step hotkey timeouts are then measured between the timestamps of the
+    events themselves, so they stay accurate even if the events are processed
+    late.
+
+    Note: only available on Linux, with Python 3.3+. Mouse events keep using
+    the wall clock.
+    """
+    global _monotonic_events
+    if not hasattr(_os_keyboard, 'set_monotonic_clock'):
+        raise NotImplementedError('Monotonic event timestamps are only available on Linux.')
+    _os_keyboard.set_monotonic_clock(enabled)
+    _monotonic_events = enabled
+
+def set_repeat_policy(policy):
+    """
+    Chooses what to do with the KEY_DOWN events the OS generates while a key
+    is held down (autorepeat):
+
+    - `keyboard.REPEAT_PASS` (default): report all of them.
+    - `keyboard.REPEAT_DROP`: report none, so holding a key doesn't flood hooks
+    and hotkeys.
+    - `keyboard.REPEAT_SINGLE`: report only the first one.
+
+    Repeats are reported with `event.is_repeat` set, and `event.repeat_count`
+    tells how many times the key has repeated so far. The KEY_UP event carries
+    the total, even for repeats that were not reported. Other programs still
+    receive all repeats.
+
+    Note: only available on Linux.
+    """
+    if policy not in (REPEAT_PASS, REPEAT_DROP, REPEAT_SINGLE):
+        raise ValueError('Unknown repeat policy {}.'.format(repr(policy)))
+    if not hasattr(_os_keyboard, 'set_repeat_policy'):
+        raise NotImplementedError('Repeat policies are only available on Linux.')
+    _os_keyboard.set_repeat_policy(policy)
+
 def on_press(callback, suppress=False):
     """
     Invokes `callback` for every KEY_DOWN event. For details see `hook`.
     """
-    return hook(lambda e: e.event_type == KEY_UP or callback(e), suppress=suppress)
+    return _hook(callback, suppress, lambda: None, (KEY_DOWN,))
 
 def on_release(callback, suppress=False):
     """
     Invokes `callback` for every KEY_UP event. For details see `hook`.
     """
-    return hook(lambda e: e.event_type == KEY_DOWN or callback(e), suppress=suppress)
+    return _hook(callback, suppress, lambda: None, (KEY_UP,))
 
 def hook_key(key, callback, suppress=False):
     """
@@ -606,18 +1266,21 @@ def hook_key(key, callback, suppress=False):
     Note: this function shares state with hotkeys, so `clear_all_hotkeys`
     affects it as well.
     """
+    return _hook_key(key, callback, suppress, (KEY_DOWN, KEY_UP))
+
+def _hook_key(key, callback, suppress, event_types):
     _listener.start_if_necessary()
     store = _listener.blocking_keys if suppress else _listener.nonblocking_keys
-    scan_codes = key_to_scan_codes(key)
-    for scan_code in scan_codes:
-        store[scan_code].append(callback)
+    keys = [(event_type, scan_code) for event_type in event_types for scan_code in key_to_scan_codes(key)]
+    for store_key in keys:
+        store[store_key].append(callback)
 
     def remove_():
         _hooks.pop(callback, None)
         _hooks.pop(key, None)
         _hooks.pop(remove_ ,None)
-        for scan_code in scan_codes:
-            store[scan_code].remove(callback)
+        for store_key in keys:
+            store[store_key].remove(callback)
     _hooks[callback] = _hooks[key] = _hooks[remove_] = remove_
     return remove_
 
@@ -625,13 +1288,34 @@ def on_press_key(key, callback, suppress=False):
     """
     Invokes `callback` for KEY_DOWN event related to the given key. For details see `hook`.
     """
-    return hook_key(key, lambda e: e.event_type == KEY_UP or callback(e), suppress=suppress)
+    return _hook_key(key, callback, suppress, (KEY_DOWN,))
 
 def on_release_key(key, callback, suppress=False):
     """
     Invokes `callback` for KEY_UP event related to the given key. For details see `hook`.
     """
-    return hook_key(key, lambda e: e.event_type == KEY_DOWN or callback(e), suppress=suppress)
+    return _hook_key(key, callback, suppress, (KEY_UP,))
+
+def on_device_change(callback):
+    """
+    Invokes `callback(action, device)` every time a keyboard is plugged in or
+    removed while the program is running, with `action` being either 'added'
+    or 'removed' and `device` the device identifier (same as `event.device`).
+    New keyboards are listened to automatically, this is only a notification.
+    Returns the function to remove the listener, also accepted by `unhook`.
+
+    Note: only available on Linux.
+    """
+    if not hasattr(_os_keyboard, 'add_device_listener'):
+        raise NotImplementedError('Device change notifications are only available on Linux.')
+    _listener.start_if_necessary()
+    remove = _os_keyboard.add_device_listener(callback)
+    def remove_():
+        _hooks.pop(callback, None)
+        _hooks.pop(remove_, None)
+        remove()
+    _hooks[callback] = _hooks[remove_] = remove_
+    return remove_
 
 def unhook(remove):
     """
@@ -649,8 +1333,9 @@ def unhook_all():
     _listener.start_if_necessary()
     _listener.blocking_keys.clear()
     _listener.nonblocking_keys.clear()
-    del _listener.blocking_hooks[:]
-    del _listener.handlers[:]
+    for hook_list in _listener.blocking_hooks.values():
+        del hook_list[:]
+    _listener.remove_all_handlers()
     unhook_all_hotkeys()
 
 def block_key(key):
@@ -690,27 +1375,46 @@ def parse_hotkey_combinations(hotkey):
 
     return tuple(tuple(combine_step(step)) for step in parse_hotkey(hotkey))
 
-def _add_hotkey_step(handler, combinations, suppress):
+def _replay(events):
+    """
+    Re-sends suppressed key events. Unlike `send`, it doesn't make the listener
+    ignore events on other threads: sequences may expire on the scheduler
+    thread, while the listener is processing real events.
     """
-    Hooks a single-step hotkey (e.g. 'shift+a').
+    _listener.replaying.active = True
+    try:
+        with _batch():
+            for event in events:
+                if event.event_type == KEY_DOWN:
+                    _os_keyboard.press(event.scan_code)
+                else:
+                    _os_keyboard.release(event.scan_code)
+    finally:
+        _listener.replaying.active = False
+
+def _add_hotkey_step(handler, step, suppress):
+    """
+    Hooks a single-step hotkey (e.g. 'shift+a'), given as a tuple of keys, each
+    a tuple of the scan codes that can stand for it (see `parse_hotkey`).
     """
     container = _listener.blocking_hotkeys if suppress else _listener.nonblocking_hotkeys
 
-    # Register the scan codes of every possible combination of
-    # modfiier + main key. Modifiers have to be registered in 
-    # filtered_modifiers too, so suppression and replaying can work.
-    for scan_codes in combinations:
-        for scan_code in scan_codes:
-            if is_modifier(scan_code):
-                _listener.filtered_modifiers[scan_code] += 1
-        container[scan_codes].append(handler)
+    # Modifiers have to be registered in filtered_modifiers too, so
+    # suppression and replaying can work.
+    modifiers = [scan_code for key in step for scan_code in key if is_modifier(scan_code)]
+    for scan_code in modifiers:
+        _listener.filtered_modifiers[scan_code] += 1
+    entry = container.add(step, handler)
 
+    # Multi-step hotkeys may race to remove the same step.
+    removed = []
     def remove():
-        for scan_codes in combinations:
-            for scan_code in scan_codes:
-                if is_modifier(scan_code):
-                    _listener.filtered_modifiers[scan_code] -= 1
-            container[scan_codes].remove(handler)
+        if removed:
+            return
+        removed.append(True)
+        container.remove(entry, handler)
+        for scan_code in modifiers:
+            _listener.filtered_modifiers[scan_code] -= 1
     return remove
 
 _hotkeys = {}
@@ -756,7 +1460,7 @@ def add_hotkey(hotkey, callback, args=(), suppress=False, timeout=1, trigger_on_
 
     _listener.start_if_necessary()
 
-    steps = parse_hotkey_combinations(hotkey)
+    steps = parse_hotkey(hotkey)
 
     event_type = KEY_UP if trigger_on_release else KEY_DOWN
     if len(steps) == 1:
@@ -777,81 +1481,84 @@ def add_hotkey(hotkey, callback, args=(), suppress=False, timeout=1, trigger_on_
         return remove_
 
     state = _State()
-    state.remove_catch_misses = lambda: None
     state.remove_last_step = None
     state.suppressed_events = []
-    state.last_update = float('-inf')
-    
-    def catch_misses(event, force_fail=False):
-        if (
-                event.event_type == event_type
-                and state.index
-                and event.scan_code not in allowed_keys_by_step[state.index]
-            ) or (
-                timeout
-                and _time.monotonic() - state.last_update >= timeout
-            ) or force_fail: # Weird formatting to ensure short-circuit.
+    # Steps are taken on the listener threads, but timeouts expire on the
+    # scheduler's.
+    state.lock = _RLock()
 
+    def fail():
+        with state.lock:
             state.remove_last_step()
 
-            for event in state.suppressed_events:
-                if event.event_type == KEY_DOWN:
-                    press(event.scan_code)
-                else:
-                    release(event.scan_code)
+            _replay(state.suppressed_events)
             del state.suppressed_events[:]
 
-            index = 0
             set_index(0)
-        return True
 
-    def set_index(new_index):
+    def fail_broken():
+        # Called by `hotkey_sequences` when a key or timeout breaks the
+        # sequence. Skipped if it was reset, or advanced to a new step, since.
+        with state.lock:
+            if state.index != 0 and not _listener.hotkey_sequences.is_waiting(state):
+                fail()
+    state.fail = fail_broken
+
+    def set_index(new_index, event=None):
         state.index = new_index
 
         if new_index == 0:
-            # This is done for performance reasons, avoiding a global key hook
-            # that is always on.
-            state.remove_catch_misses()
-            state.remove_catch_misses = lambda: None
-        elif new_index == 1:
-            state.remove_catch_misses()
-            # Must be `suppress=True` to ensure `send` has priority.
-            state.remove_catch_misses = hook(catch_misses, suppress=True)
+            # Only hotkeys in progress are checked for misses on every event.
+            _listener.hotkey_sequences.discard(state)
+        else:
+            _listener.hotkey_sequences.wait(state, event_type, allowed_keys_by_step[new_index], timeout, event)
 
         if new_index == len(steps) - 1:
             def handler(event):
-                if event.event_type == KEY_UP:
-                    remove()
-                    set_index(0)
-                accept = event.event_type == event_type and callback() 
-                if accept:
-                    return catch_misses(event, force_fail=True)
-                else:
-                    state.suppressed_events[:] = [event]
-                    return False
+                with state.lock:
+                    if state.remove_last_step is not remove:
+                        # Fetched before the sequence was reset.
+                        return True
+                    if event.event_type == KEY_UP:
+                        remove()
+                        set_index(0)
+                    accept = event.event_type == event_type and callback() 
+                    if accept:
+                        _listener.hotkey_sequences.discard(state)
+                        fail()
+                        return True
+                    else:
+                        state.suppressed_events[:] = [event]
+                        return False
             remove = _add_hotkey_step(handler, steps[state.index], suppress)
         else:
             # Fix value of next_index.
             def handler(event, new_index=state.index+1):
-                if event.event_type == KEY_UP:
-                    remove()
-                    set_index(new_index)
-                state.suppressed_events.append(event)
-                return False
+                with state.lock:
+                    if state.remove_last_step is not remove:
+                        return True
+                    if event.event_type == KEY_UP:
+                        remove()
+                        set_index(new_index, event)
+                    state.suppressed_events.append(event)
+                    return False
             remove = _add_hotkey_step(handler, steps[state.index], suppress)
         state.remove_last_step = remove
-        state.last_update = _time.monotonic()
         return False
-    set_index(0)
 
     allowed_keys_by_step = [
         set().union(*step)
         for step in steps
     ]
+    with state.lock:
+        set_index(0)
 
     def remove_():
-        state.remove_catch_misses()
-        state.remove_last_step()
+        with state.lock:
+            _listener.hotkey_sequences.discard(state)
+            state.remove_last_step()
+            # Also disables the step handlers the listener already fetched.
+            state.remove_last_step = lambda: None
         _hotkeys.pop(hotkey, None)
         _hotkeys.pop(remove_, None)
         _hotkeys.pop(callback, None)
@@ -878,6 +1585,7 @@ def unhook_all_hotkeys():
     # are removed together.
     _listener.blocking_hotkeys.clear()
     _listener.nonblocking_hotkeys.clear()
+    _listener.hotkey_sequences.clear()
 unregister_all_hotkeys = remove_all_hotkeys = clear_all_hotkeys = unhook_all_hotkeys
 
 def remap_hotkey(src, dst, suppress=True, trigger_on_release=False):
@@ -922,10 +1630,11 @@ def restore_state(scan_codes):
     with _pressed_events_lock:
         current = set(_pressed_events)
     target = set(scan_codes)
-    for scan_code in current - target:
-        _os_keyboard.release(scan_code)
-    for scan_code in target - current:
-        _os_keyboard.press(scan_code)
+    with _batch():
+        for scan_code in current - target:
+            _os_keyboard.release(scan_code)
+        for scan_code in target - current:
+            _os_keyboard.press(scan_code)
 
     _listener.is_replaying = False
 
@@ -956,39 +1665,43 @@ def write(text, delay=0, restore_state_after=True, exact=None):
     if exact is None:
         exact = _platform.system() == 'Windows'
 
-    state = stash_state()
-    
-    # Window's typing of unicode characters is quite efficient and should be preferred.
-    if exact:
-        for letter in text:
-            if letter in '\n\b':
-                send(letter)
-            else:
-                _os_keyboard.type_unicode(letter)
-            if delay: _time.sleep(delay)
-    else:
-        for letter in text:
-            try:
-                entries = _os_keyboard.map_name(normalize_name(letter))
-                scan_code, modifiers = next(iter(entries))
-            except (KeyError, ValueError, StopIteration):
-                _os_keyboard.type_unicode(letter)
-                continue
-            
-            for modifier in modifiers:
-                press(modifier)
-
-            _os_keyboard.press(scan_code)
-            _os_keyboard.release(scan_code)
-
-            for modifier in modifiers:
-                release(modifier)
-
-            if delay:
-                _time.sleep(delay)
-
-    if restore_state_after:
-        restore_modifiers(state)
+    with _batch() as batch:
+        state = stash_state()
+        
+        # Window's typing of unicode characters is quite efficient and should be preferred.
+        if exact:
+            for letter in text:
+                if letter in '\n\b':
+                    send(letter)
+                else:
+                    _os_keyboard.type_unicode(letter)
+                if delay:
+                    batch.flush()
+                    _time.sleep(delay)
+        else:
+            for letter in text:
+                try:
+                    entries = _os_keyboard.map_name(normalize_name(letter))
+                    scan_code, modifiers = next(iter(entries))
+                except (KeyError, ValueError, StopIteration):
+                    _os_keyboard.type_unicode(letter)
+                    continue
+                
+                for modifier in modifiers:
+                    press(modifier)
+
+                _os_keyboard.press(scan_code)
+                _os_keyboard.release(scan_code)
+
+                for modifier in modifiers:
+                    release(modifier)
+
+                if delay:
+                    batch.flush()
+                    _time.sleep(delay)
+
+        if restore_state_after:
+            restore_modifiers(state)
 
 def wait(hotkey=None, suppress=False, trigger_on_release=False):
     """
@@ -1170,18 +1883,22 @@ def play(events, speed_factor=1.0):
     Note: the current keyboard state is cleared at the beginning and restored at
     the end of the function.
     """
-    state = stash_state()
+    with _batch() as batch:
+        state = stash_state()
 
-    last_time = None
-    for event in events:
-        if speed_factor > 0 and last_time is not None:
-            _time.sleep((event.time - last_time) / speed_factor)
-        last_time = event.time
+        last_time = None
+        for event in events:
+            if speed_factor > 0 and last_time is not None:
+                delay = (event.time - last_time) / speed_factor
+                if delay > 0:
+                    batch.flush()
+                    _time.sleep(delay)
+            last_time = event.time
 
-        key = event.scan_code or event.name
-        press(key) if event.event_type == KEY_DOWN else release(key)
+            key = event.scan_code or event.name
+            press(key) if event.event_type == KEY_DOWN else release(key)
 
-    restore_modifiers(state)
+        restore_modifiers(state)
 replay = play
 
 _word_listeners = {}
@@ -2,6 +2,7 @@
 from threading import Thread, Lock
 import traceback
 import functools
+from collections import OrderedDict
 
 try:
     from queue import Queue
@@ -12,14 +13,49 @@ class GenericListener(object):
     lock = Lock()
 
     def __init__(self):
-        self.handlers = []
+        # Registered (handler, event type, scan codes, predicate), by token,
+        # in insertion order. Only changed under `handlers_lock`; `snapshots`
+        # holds immutable tuples of it per (event type, scan code), rebuilt
+        # lazily (cleared on change) so registration stays O(1) and dispatch
+        # never sees a list being modified. Handlers don't need to be
+        # hashable.
+        self.handlers_lock = Lock()
+        self.handlers_by_token = OrderedDict()
+        self.snapshots = {}
+        self.token_count = 0
         self.listening = False
         self.queue = Queue()
 
+    def get_handlers(self, event_type=None, scan_code=None):
+        """
+        Returns a tuple with the (handler, predicate) pairs, in order, that
+        receive events of this type and scan code. The predicate is None if
+        the handler takes all of them.
+        """
+        key = (event_type, scan_code)
+        handlers = self.snapshots.get(key)
+        if handlers is None:
+            with self.handlers_lock:
+                handlers = tuple((handler, predicate) for handler, handler_type, scan_codes, predicate in self.handlers_by_token.values()
+                                 if (handler_type is None or handler_type == event_type)
+                                 and (scan_codes is None or scan_code in scan_codes))
+                self.snapshots[key] = handlers
+        return handlers
+
+    def get_event_handlers(self, event):
+        return self.get_handlers(getattr(event, 'event_type', None), getattr(event, 'scan_code', None))
+
+    def wants(self, event):
+        """ Returns True if any handler would receive this event. """
+        for handler, predicate in self.get_event_handlers(event):
+            if predicate is None or predicate(event):
+                return True
+        return False
+
     def invoke_handlers(self, event):
-        for handler in self.handlers:
+        for handler, predicate in self.get_event_handlers(event):
             try:
-                if handler(event):
+                if (predicate is None or predicate(event)) and handler(event):
                     # Stop processing this hotkey.
                     return 1
             except Exception as e:
@@ -59,15 +95,42 @@ class GenericListener(object):
                 self.invoke_handlers(event)
             self.queue.task_done()
             
-    def add_handler(self, handler):
+    def add_handler(self, handler, event_type=None, scan_codes=None, predicate=None):
         """
         Adds a function to receive each event captured, starting the capturing
-        process if necessary.
+        process if necessary. It can be restricted to the events with this
+        `event_type`, with a scan code in `scan_codes` and for which
+        `predicate(event)` is true. Returns a token for `remove_token`.
         """
         self.start_if_necessary()
-        self.handlers.append(handler)
+        with self.handlers_lock:
+            self.token_count += 1
+            token = self.token_count
+            if scan_codes is not None:
+                scan_codes = frozenset(scan_codes)
+            self.handlers_by_token[token] = (handler, event_type, scan_codes, predicate)
+            self.snapshots = {}
+        return token
+
+    def remove_token(self, token):
+        """ Removes the handler registration identified by `token`. """
+        with self.handlers_lock:
+            if self.handlers_by_token.pop(token, None) is not None:
+                self.snapshots = {}
 
     def remove_handler(self, handler):
-        """ Removes a previously added event handler. """
-        while handler in self.handlers:
-            self.handlers.remove(handler)
+        """
+        Removes a previously added event handler, compared by equality. Prefer
+        `remove_token`, which doesn't scan all handlers.
+        """
+        with self.handlers_lock:
+            for token, registration in list(self.handlers_by_token.items()):
+                if registration[0] == handler:
+                    del self.handlers_by_token[token]
+            self.snapshots = {}
+
+    def remove_all_handlers(self):
+        """ Removes all event handlers. """
+        with self.handlers_lock:
+            self.handlers_by_token.clear()
+            self.snapshots = {}
@@ -12,28 +12,58 @@ except NameError:
 KEY_DOWN = 'down'
 KEY_UP = 'up'
 
+# What to do with the KEY_DOWN events generated by the OS while a key is held
+# down (autorepeat), see `keyboard.set_repeat_policy`.
+REPEAT_PASS = 'pass'
+REPEAT_DROP = 'drop'
+REPEAT_SINGLE = 'single'
+
+# Single copy of each key name, so long recordings don't hold millions of
+# equal strings. A dict instead of `sys.intern` because Python 2 can't intern
+# unicode.
+_interned_names = {}
+_new_object = object.__new__
+def intern_name(name):
+    return _interned_names.setdefault(name, name)
+
 class KeyboardEvent(object):
-    event_type = None
-    scan_code = None
-    name = None
-    time = None
-    device = None
-    modifiers = None
-    is_keypad = None
-
-    def __init__(self, event_type, scan_code, name=None, time=None, device=None, modifiers=None, is_keypad=None):
+    __slots__ = ('event_type', 'scan_code', 'name', 'time', 'device', 'modifiers', 'is_keypad', 'is_repeat', 'repeat_count')
+
+    def __init__(self, event_type, scan_code, name=None, time=None, device=None, modifiers=None, is_keypad=None, is_repeat=False, repeat_count=0):
         self.event_type = event_type
         self.scan_code = scan_code
+        if name:
+            name = normalize_name(name)
+            name = intern_name(name)
+        self.name = name or None
         self.time = now() if time is None else time
         self.device = device
+        self.modifiers = modifiers
         self.is_keypad = is_keypad
+        self.is_repeat = is_repeat
+        self.repeat_count = repeat_count
+
+    @classmethod
+    def trusted(cls, event_type, scan_code, name, time, device=None, modifiers=None, is_keypad=None, is_repeat=False, repeat_count=0):
+        """
+        Faster constructor for backends, which already produce canonical (and
+        interned) names. The name is used as given.
+        """
+        self = _new_object(cls)
+        self.event_type = event_type
+        self.scan_code = scan_code
+        self.name = name
+        self.time = time
+        self.device = device
         self.modifiers = modifiers
-        if name:
-            self.name = normalize_name(name)
+        self.is_keypad = is_keypad
+        self.is_repeat = is_repeat
+        self.repeat_count = repeat_count
+        return self
 
     def to_json(self, ensure_ascii=False):
         attrs = dict(
-            (attr, getattr(self, attr)) for attr in ['event_type', 'scan_code', 'name', 'time', 'device', 'is_keypad', 'modifiers']
+            (attr, getattr(self, attr)) for attr in ['event_type', 'scan_code', 'name', 'time', 'device', 'is_keypad', 'modifiers', 'is_repeat', 'repeat_count']
             if not attr.startswith('_')
         )
         return json.dumps(attrs, ensure_ascii=ensure_ascii)
@@ -41,13 +71,37 @@ class KeyboardEvent(object):
     def __repr__(self):
         return 'KeyboardEvent({} {})'.format(self.name or 'Unknown {}'.format(self.scan_code), self.event_type)
 
-    def __eq__(self, other):
+    def key(self):
+        """
+        Returns the tuple `(event_type, scan_code, name)` identifying this key
+        event, ignoring time and device. Use it to compare events strictly, or
+        to put them in dicts and sets:
+
+            set(event.key() for event in events)
+        """
+        return (self.event_type, self.scan_code, self.name)
+
+    def matches(self, other):
+        """
+        Returns True if both events have the same type, and their scan codes
+        and names either match or are missing from one of them. This is what
+        `==` compares.
+        """
         return (
-            isinstance(other, KeyboardEvent)
-            and self.event_type == other.event_type
+            self.event_type == other.event_type
             and (
                 not self.scan_code or not other.scan_code or self.scan_code == other.scan_code
             ) and (
                 not self.name or not other.name or self.name == other.name
             )
         )
+
+    def __eq__(self, other):
+        return isinstance(other, KeyboardEvent) and self.matches(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    # A missing scan code or name matches anything, so no hash can agree with
+    # `==`. Use `key()` for dicts and sets.
+    __hash__ = None
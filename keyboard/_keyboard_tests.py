@@ -16,6 +16,7 @@ from __future__ import print_function
 
 import unittest
 import time
+import threading
 
 import keyboard
 from ._keyboard_event import KeyboardEvent, KEY_DOWN, KEY_UP
@@ -67,6 +68,8 @@ keyboard._os_keyboard.map_name = dummy_keys.__getitem__
 keyboard._os_keyboard.press = lambda scan_code: send_instant_event(make_event(KEY_DOWN, None, scan_code))
 keyboard._os_keyboard.release = lambda scan_code: send_instant_event(make_event(KEY_UP, None, scan_code))
 keyboard._os_keyboard.type_unicode = lambda char: output_events.append(KeyboardEvent(event_type=KEY_DOWN, scan_code=999, name=char))
+keyboard._os_keyboard.batch = keyboard._NoBatch
+keyboard._os_keyboard.get_pressed_events = lambda: []
 
 # Shortcuts for defining test inputs and expected outputs.
 # Usage: d_shift + d_a + u_a + u_shift
@@ -134,6 +137,41 @@ class TestKeyboard(unittest.TestCase):
         import json
         self.assertEqual(event, KeyboardEvent(**json.loads(event.to_json())))
 
+    def test_event_json_repeat(self):
+        event = KeyboardEvent(KEY_DOWN, 1, 'a', is_repeat=True, repeat_count=3)
+        import json
+        loaded = KeyboardEvent(**json.loads(event.to_json()))
+        self.assertEqual((loaded.is_repeat, loaded.repeat_count), (True, 3))
+
+    def test_event_interned_name(self):
+        a = KeyboardEvent(KEY_DOWN, 1, 'LEFT_CONTROL')
+        b = KeyboardEvent(KEY_DOWN, 1, ''.join(['left ', 'ctrl']))
+        self.assertEqual(a.name, 'left ctrl')
+        self.assertIs(a.name, b.name)
+        self.assertFalse(hasattr(a, '__dict__'))
+
+    def test_event_trusted(self):
+        event = KeyboardEvent.trusted(KEY_UP, 1, 'left ctrl', 5, device='d')
+        self.assertEqual(event, KeyboardEvent(KEY_UP, 1, 'left ctrl', 5))
+        self.assertEqual((event.time, event.device, event.is_repeat), (5, 'd', False))
+
+    def test_event_key_and_matches(self):
+        event = KeyboardEvent(KEY_DOWN, 1, 'a', time=1)
+        self.assertEqual(event.key(), (KEY_DOWN, 1, 'a'))
+        self.assertTrue(event.matches(KeyboardEvent(KEY_DOWN, None, 'a')))
+        self.assertFalse(event.matches(KeyboardEvent(KEY_UP, 1, 'a')))
+        self.assertEqual(event, KeyboardEvent(KEY_DOWN, None, 'a'))
+        self.assertNotEqual(event.key(), KeyboardEvent(KEY_DOWN, None, 'a').key())
+        self.assertEqual(len(set([event.key(), KeyboardEvent(KEY_DOWN, 1, 'a', time=2).key(), KeyboardEvent(KEY_DOWN, 2, 'a').key()])), 2)
+
+    def test_event_unhashable(self):
+        with self.assertRaises(TypeError):
+            set([KeyboardEvent(KEY_DOWN, 1, 'a')])
+
+    def test_set_repeat_policy_invalid(self):
+        with self.assertRaises(ValueError):
+            keyboard.set_repeat_policy('sometimes')
+
     def test_is_modifier_name(self):
         for name in keyboard.all_modifiers:
             self.assertTrue(keyboard.is_modifier(name))
@@ -208,6 +246,24 @@ class TestKeyboard(unittest.TestCase):
     def test_parse_hotkey_list_names(self):
         self.assertEqual(keyboard.parse_hotkey(['a', 'b', 'c']), (((1,), (2,), (3,)),))
 
+    def test_is_pressed_initial_state(self):
+        keyboard._os_keyboard.get_pressed_events = lambda: d_shift+d_a
+        try:
+            keyboard._listener.init()
+        finally:
+            keyboard._os_keyboard.get_pressed_events = lambda: []
+        self.assertTrue(keyboard.is_pressed('shift+a'))
+        self.assertEqual(keyboard._listener.active_modifiers, set([5]))
+        self.do(u_a+u_shift, u_a+u_shift)
+        self.assertFalse(keyboard.is_pressed('shift'))
+    def test_pressed_scan_codes(self):
+        keyboard._listener.start_if_necessary()
+        self.do(d_shift+d_ctrl+d_a+d_a)
+        self.assertEqual(keyboard._pressed_scan_codes, (1, 5, 7))
+        self.do(u_ctrl)
+        self.assertEqual(keyboard._pressed_scan_codes, (1, 5))
+        self.do(u_a+u_shift)
+        self.assertEqual(keyboard._pressed_scan_codes, ())
     def test_is_pressed_none(self):
         self.assertFalse(keyboard.is_pressed('a'))
     def test_is_pressed_true(self):
@@ -275,6 +331,25 @@ class TestKeyboard(unittest.TestCase):
         self.assertFalse(triggered)
         time.sleep(0.05)
         self.assertTrue(triggered)
+    def test_cancel_call_later(self):
+        triggered = []
+        handle = keyboard.call_later(lambda: triggered.append(True), delay=0.01)
+        keyboard.cancel_call_later(handle)
+        time.sleep(0.05)
+        self.assertFalse(triggered)
+    def test_call_later_drain(self):
+        triggered = []
+        keyboard.call_later(lambda: keyboard.call_later(triggered.append, (2,), 0.01) and triggered.append(1), delay=0.01)
+        keyboard.cancel_call_later(keyboard.call_later(triggered.append, (3,), 0.01))
+        keyboard._scheduler.drain()
+        self.assertEqual(sorted(triggered), [1, 2])
+        self.assertEqual(keyboard._scheduler.pending, 0)
+    def test_call_later_order(self):
+        triggered = []
+        for i in range(10):
+            keyboard.call_later(triggered.append, (i,), 0.01 + i * 0.001)
+        time.sleep(0.1)
+        self.assertEqual(sorted(triggered), list(range(10)))
 
     def test_hook_nonblocking(self):
         self.i = 0
@@ -293,6 +368,79 @@ class TestKeyboard(unittest.TestCase):
         keyboard.unhook_all()
         self.do(d_a+u_a, d_a+u_a)
         self.assertEqual(self.i, 4)
+    def test_hook_filter(self):
+        events = []
+        keyboard.hook(lambda e: events.append(e), filter={'event_types': KEY_DOWN, 'names': ['a', 'b']})
+        self.do(du_a+du_b+du_c, du_a+du_b+du_c)
+        self.assertEqual([(e.event_type, e.name) for e in events], [(KEY_DOWN, 'a'), (KEY_DOWN, 'b')])
+    def test_hook_filter_scan_codes(self):
+        events = []
+        keyboard.hook(lambda e: events.append(e), filter={'scan_codes': 2})
+        self.assertEqual(len(keyboard._listener.get_handlers(KEY_DOWN, 2)), 1)
+        self.assertEqual(keyboard._listener.get_handlers(KEY_DOWN, 1), ())
+        self.do(du_a+du_b)
+        self.assertEqual([(e.event_type, e.name) for e in events], [(KEY_DOWN, 'b'), (KEY_UP, 'b')])
+    def test_hook_filter_error_keeps_listening(self):
+        def fail(e):
+            raise ValueError()
+        events = []
+        keyboard.hook(fail, filter={'scan_codes': 1})
+        keyboard.hook(lambda e: events.append(e))
+        # Silence the traceback printed by the listener.
+        print_exc = keyboard._generic.traceback.print_exc
+        keyboard._generic.traceback.print_exc = lambda: None
+        try:
+            self.do(du_a+du_b)
+        finally:
+            keyboard._generic.traceback.print_exc = print_exc
+        self.assertEqual(len(events), 4)
+    def test_hook_filter_device_and_repeat(self):
+        events = []
+        keyboard.hook(lambda e: events.append(e), filter={'devices': 'kbd', 'exclude_repeat': True})
+        repeat = KeyboardEvent(KEY_DOWN, 1, 'a', device='kbd', is_repeat=True)
+        other = KeyboardEvent(KEY_DOWN, 1, 'a', device='other')
+        accepted = KeyboardEvent(KEY_DOWN, 1, 'a', device='kbd')
+        self.do([repeat, other, accepted])
+        self.assertEqual(events, [accepted])
+    def test_hook_filter_blocking(self):
+        keyboard.hook(lambda e: False, suppress=True, filter={'scan_codes': 1, 'event_types': KEY_DOWN})
+        self.do(du_a+du_b, u_a+du_b)
+    def test_hook_filter_invalid(self):
+        with self.assertRaises(ValueError):
+            keyboard.hook(lambda e: None, filter={'keys': 'a'})
+        with self.assertRaises(ValueError):
+            keyboard.hook(lambda e: None, filter={'event_types': 'sideways'})
+        for suppress in (False, True):
+            with self.assertRaises(ValueError):
+                keyboard.hook(lambda e: None, suppress=suppress, filter={'event_types': []})
+        with self.assertRaises(ValueError):
+            keyboard.hook(lambda e: None, filter={'scan_codes': 'a'})
+        with self.assertRaises(ValueError):
+            keyboard.hook(lambda e: None, filter={'scan_codes': [1, 'b']})
+    def test_hook_filter_skips_queue(self):
+        keyboard.hook(lambda e: None, filter={'event_types': KEY_UP})
+        keyboard._listener.direct_callback(d_a[0])
+        self.assertTrue(keyboard._listener.queue.empty())
+        keyboard._listener.direct_callback(u_a[0])
+        keyboard._listener.queue.join()
+    def test_hook_filter_names_skips_queue(self):
+        keyboard.hook(lambda e: None, filter={'names': 'b'})
+        keyboard._listener.direct_callback(d_a[0])
+        self.assertTrue(keyboard._listener.queue.empty())
+        keyboard._listener.direct_callback(d_b[0])
+        keyboard._listener.queue.join()
+    def test_handler_tokens(self):
+        events = []
+        keyboard._listener.add_handler(lambda e: events.append(1))
+        second = keyboard._listener.add_handler(lambda e: events.append(2))
+        keyboard._listener.add_handler(lambda e: events.append(3))
+        self.do(d_a)
+        self.assertEqual(events, [1, 2, 3])
+        keyboard._listener.remove_token(second)
+        keyboard._listener.remove_token(second)
+        self.do(d_a)
+        self.assertEqual(events, [1, 2, 3, 1, 3])
+        self.assertEqual(len(keyboard._listener.get_handlers()), 2)
     def test_hook_blocking(self):
         self.i = 0
         def count(e):
@@ -320,6 +468,19 @@ class TestKeyboard(unittest.TestCase):
     def test_on_release(self):
         keyboard.on_release(lambda e: self.assertEqual(e.name, 'a') and self.assertEqual(e.event_type, KEY_UP))
         self.do(d_a+u_a)
+    def test_on_press_indexed_by_event_type(self):
+        keyboard.on_press(lambda e: None)
+        keyboard.on_release(lambda e: None, suppress=True)
+        self.assertEqual(len(keyboard._listener.get_handlers(KEY_DOWN)), 1)
+        self.assertEqual(keyboard._listener.get_handlers(KEY_UP), ())
+        self.assertEqual(keyboard._listener.blocking_hooks[KEY_DOWN], [])
+        self.assertEqual(len(keyboard._listener.blocking_hooks[KEY_UP]), 1)
+    def test_on_press_does_not_stop_release_handlers(self):
+        released = []
+        keyboard.on_press(lambda e: None)
+        keyboard.on_release(lambda e: released.append(e))
+        self.do(d_a+u_a)
+        self.assertEqual(len(released), 1)
 
     def test_hook_key_invalid(self):
         with self.assertRaises(ValueError):
@@ -362,6 +523,10 @@ class TestKeyboard(unittest.TestCase):
     def test_on_release_key(self):
         keyboard.on_release_key('a', lambda e: self.assertEqual(e.name, 'a') and self.assertEqual(e.event_type, KEY_UP))
         self.do(d_a+u_a)
+    def test_on_press_key_indexed_by_event_type(self):
+        keyboard.on_press_key('a', lambda e: None)
+        self.assertEqual(len(keyboard._listener.nonblocking_keys[KEY_DOWN, 1]), 1)
+        self.assertEqual(keyboard._listener.nonblocking_keys[KEY_UP, 1], [])
 
     def test_block_key(self):
         blocked = keyboard.block_key('a')
@@ -432,6 +597,19 @@ class TestKeyboard(unittest.TestCase):
         keyboard.write(u'áb', exact=False)
         self.do([], [KeyboardEvent(event_type=KEY_DOWN, scan_code=999, name=u'á')]+d_b+u_b)
 
+    def test_send_batch(self):
+        batches = []
+        class Batch(keyboard._NoBatch):
+            def __exit__(self, *args):
+                batches.append(len(output_events))
+        keyboard._os_keyboard.batch = Batch
+        try:
+            keyboard.send('shift+a')
+        finally:
+            keyboard._os_keyboard.batch = keyboard._NoBatch
+        self.assertEqual(batches, [4])
+        self.do([], d_shift+d_a+u_a+u_shift)
+
     def test_start_stop_recording(self):
         keyboard.start_recording()
         self.do(d_a+u_a)
@@ -460,6 +638,19 @@ class TestKeyboard(unittest.TestCase):
         self.do(d_ctrl)
         keyboard.play(d_a+u_a, 0)
         self.do([], u_ctrl+d_a+u_a+d_ctrl)
+    def test_play_flushes_before_delay(self):
+        flushes = []
+        class Batch(keyboard._NoBatch):
+            def flush(self):
+                flushes.append(len(output_events))
+        keyboard._os_keyboard.batch = Batch
+        try:
+            events = [make_event(KEY_DOWN, 'a', 1, 100), make_event(KEY_UP, 'a', 1, 100.01)]
+            keyboard.play(events, 1)
+        finally:
+            keyboard._os_keyboard.batch = keyboard._NoBatch
+        self.assertEqual(flushes, [1])
+        self.do([], d_a+u_a)
     def test_play_delay(self):
         last_time = time.time()
         events = [make_event(KEY_DOWN, 'a', 1, 100), make_event(KEY_UP, 'a', 1, 100.01)]
@@ -588,6 +779,33 @@ class TestKeyboard(unittest.TestCase):
         keyboard.remove_hotkey(keyboard.add_hotkey('ctrl+a', trigger, suppress=True))
         self.do(d_ctrl+d_a, d_ctrl+d_a)
         self.assertEqual(keyboard._listener.filtered_modifiers[dummy_keys['left ctrl'][0][0]], 0)
+    def test_add_hotkey_sided_modifiers_single_entry(self):
+        keyboard.add_hotkey('shift+ctrl+a', trigger, suppress=True)
+        self.assertEqual(len(keyboard._listener.blocking_hotkeys.values()), 1)
+        d_right_shift = [make_event(KEY_DOWN, 'right shift')]
+        u_right_shift = [make_event(KEY_UP, 'right shift')]
+        self.do(d_right_shift+d_ctrl+du_a+u_ctrl+u_right_shift, triggered_event)
+        self.do(d_shift+d_right_shift+d_ctrl+du_a+u_ctrl+u_right_shift+u_shift, d_shift+d_right_shift+d_ctrl+du_a+u_ctrl+u_right_shift+u_shift)
+    def test_hotkey_table_concurrent_remove(self):
+        import threading
+        table = keyboard._HotkeyTable()
+        handler = lambda e: None
+        entry = table.add(((1,), (2,)), handler)
+        match = table.match
+        def match_during_remove(scan_codes):
+            # The hotkey is removed by another thread while matching.
+            result = match(scan_codes)
+            thread = threading.Thread(target=table.remove, args=(entry, handler))
+            thread.start()
+            thread.join(0.1)
+            threads.append(thread)
+            return result
+        threads = []
+        table.match = match_during_remove
+        table[(1, 2)]
+        threads[0].join()
+        table.match = match
+        self.assertEqual(table[(1, 2)], [])
     def test_remove_hotkey_internal(self):
         remove = keyboard.add_hotkey('shift+a', trigger, suppress=True)
         self.assertTrue(all(keyboard._listener.blocking_hotkeys.values()))
@@ -669,6 +887,85 @@ class TestKeyboard(unittest.TestCase):
         time.sleep(0.05)
         self.do(du_a, du_a+du_b)
         self.do(du_b+du_a, triggered_event)
+    def test_add_hotkey_multi_step_event_time_timeout(self):
+        keyboard._monotonic_events = True
+        try:
+            keyboard.add_hotkey('a, b', trigger, timeout=0.05, suppress=True)
+            self.do([make_event(KEY_DOWN, 'a', time=10), make_event(KEY_UP, 'a', time=10)], [])
+            self.do([make_event(KEY_DOWN, 'b', time=11), make_event(KEY_UP, 'b', time=11)], du_a+du_b)
+        finally:
+            keyboard._monotonic_events = False
+    def test_add_hotkey_multi_step_event_time_success(self):
+        keyboard._monotonic_events = True
+        try:
+            keyboard.add_hotkey('a, b', trigger, timeout=0.5, suppress=True)
+            self.do([make_event(KEY_DOWN, 'a', time=10), make_event(KEY_UP, 'a', time=10)], [])
+            # Processed with a delay, but the events themselves were close together.
+            time.sleep(0.1)
+            self.do([make_event(KEY_DOWN, 'b', time=10.01), make_event(KEY_UP, 'b', time=10.01)], triggered_event)
+        finally:
+            keyboard._monotonic_events = False
+    def test_add_hotkey_multi_step_expires_without_events(self):
+        keyboard.add_hotkey('a, b', trigger, timeout=0.01, suppress=True)
+        self.do(du_a, [])
+        self.assertTrue(keyboard._listener.hotkey_sequences)
+        time.sleep(0.1)
+        self.assertFalse(keyboard._listener.hotkey_sequences)
+        self.do([], du_a)
+    def test_add_hotkey_multi_step_late_fail_after_advance(self):
+        keyboard.add_hotkey('a, b, c', trigger, suppress=True)
+        self.do(du_a, [])
+        sequences = keyboard._listener.hotkey_sequences
+        state, = sequences.waiting[KEY_DOWN]
+        # The timeout was detected on another thread, but before the sequence
+        # was reset the next step arrived.
+        sequences.discard(state)
+        self.do(du_b, [])
+        state.fail()
+        self.do(du_c, triggered_event)
+    def test_add_hotkey_multi_step_expire_keeps_listening(self):
+        keyboard.add_hotkey('a, b', trigger, timeout=0.01, suppress=True)
+        self.do(du_a, [])
+        accepted = []
+        press = keyboard._os_keyboard.press
+        def press_during_key(scan_code):
+            # A real key arrives on the listener thread while replaying.
+            listener = threading.Thread(target=lambda: accepted.append(keyboard._listener.direct_callback(d_c[0])))
+            listener.start()
+            listener.join()
+            press(scan_code)
+        keyboard._os_keyboard.press = press_during_key
+        try:
+            time.sleep(0.1)
+        finally:
+            keyboard._os_keyboard.press = press
+        self.assertEqual(accepted, [True])
+        self.assertIn(d_c[0].scan_code, keyboard._pressed_events)
+        self.do([], du_a)
+    def test_add_hotkey_multi_step_stale_handler(self):
+        remove = keyboard.add_hotkey('a, b, c', trigger, timeout=0.05, suppress=True)
+        self.do(du_a, [])
+        handler, = keyboard._listener.blocking_hotkeys[(2,)]
+        time.sleep(0.15)
+        self.do([], du_a)
+        # Fetched by the listener before the reset, called after it.
+        self.assertTrue(handler(d_b[0]))
+        self.assertFalse(keyboard._listener.hotkey_sequences)
+        remove()
+        self.assertEqual(keyboard._listener.blocking_hotkeys.values(), [])
+        self.do(du_a, du_a)
+    def test_add_hotkey_multi_step_stale_handler_after_remove(self):
+        remove = keyboard.add_hotkey('a, b, c', trigger, suppress=True)
+        self.do(du_a, [])
+        handler, = keyboard._listener.blocking_hotkeys[(2,)]
+        remove()
+        self.assertTrue(handler(u_b[0]))
+        self.assertEqual(keyboard._listener.blocking_hotkeys.values(), [])
+    def test_add_hotkey_step_remove_twice(self):
+        remove = keyboard._add_hotkey_step(trigger, ((5,), (1,)), True)
+        remove()
+        remove()
+        self.assertEqual(keyboard._listener.filtered_modifiers[5], 0)
     def test_add_hotkey_multi_step_allow(self):
         keyboard.add_hotkey('a, b', lambda: trigger() or True, suppress=True)
         self.do(du_a+du_b, triggered_event+du_a+du_b)
@@ -746,6 +1043,14 @@ class TestKeyboard(unittest.TestCase):
     def test_add_hotkey_multistep_suppress_modifier(self):
         keyboard.add_hotkey('shift+a, b', trigger, suppress=True)
         self.do(d_shift+du_a+u_shift+du_b, triggered_event)
+    def test_add_hotkey_multistep_no_hooks(self):
+        keyboard.add_hotkey('a, b', trigger, suppress=True)
+        keyboard.add_hotkey('a, c', trigger, suppress=True)
+        self.do(du_a, [])
+        self.assertEqual(keyboard._listener.blocking_hooks, {KEY_DOWN: [], KEY_UP: []})
+        self.assertEqual(len(keyboard._listener.hotkey_sequences.waiting[KEY_DOWN]), 2)
+        self.do(du_space)
+        self.assertFalse(keyboard._listener.hotkey_sequences)
     def test_add_hotkey_multistep_suppress_fail(self):
         keyboard.add_hotkey('a, b', trigger, suppress=True)
         self.do(du_a+du_c, du_a+du_c)
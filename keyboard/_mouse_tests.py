@@ -55,6 +55,12 @@ class TestMouse(unittest.TestCase):
     def wait_for_events_queue(self):
         mouse._listener.queue.join()
 
+    def wait_for_handlers(self, count):
+        """ Waits for another thread to install this many handlers. """
+        deadline = time.time() + 1
+        while len(mouse._listener.handlers_by_token) < count and time.time() < deadline:
+            time.sleep(0.001)
+
     def flush_events(self):
         self.wait_for_events_queue()
         events = list(self.events)
@@ -203,6 +209,7 @@ class TestMouse(unittest.TestCase):
             mouse.wait()
             lock.release()
         Thread(target=t).start()
+        self.wait_for_handlers(1)
         self.press()
         lock.acquire()
 
@@ -214,6 +221,8 @@ class TestMouse(unittest.TestCase):
             self.recorded = mouse.record(RIGHT)
             lock.release()
         Thread(target=t).start()
+        # Hooks of both `record` and its `wait`.
+        self.wait_for_handlers(2)
         self.click()
         self.wheel(5)
         self.move(100, 50)
@@ -1,16 +1,48 @@
 # -*- coding: utf-8 -*-
 import struct
 import os
+import io
+import re
 import atexit
-from time import time as now
-from threading import Thread
+import traceback
+from time import time as now, sleep
+from threading import Thread, Lock, local
 from glob import glob
+from fnmatch import fnmatch
+from collections import deque
+from contextlib import contextmanager
 try:
     from queue import Queue
 except ImportError:
     from Queue import Queue
+try:
+    import selectors
+except ImportError:
+    # Python 2, only the thread-per-device reader is available.
+    selectors = None
 
 event_bin_format = 'llHHI'
+event_struct = struct.Struct(event_bin_format)
+event_size = event_struct.size
+
+# How many `input_event` records are fetched with a single `read` syscall. A
+# key stroke is usually three records (EV_MSC scan, EV_KEY, EV_SYN), and fast
+# mice send bursts of motion, so a small multiple of that is plenty.
+events_per_read = 64
+
+# Most records sent with a single `write` by `EventDevice.batch`. uinput
+# injects a whole write before any reader runs, and readers of a keyboard only
+# have room for 64 records (8 packets of 8), after which they get SYN_DROPPED
+# and lose keys. Half of it leaves room for the real keyboards' events.
+records_per_write = 32
+
+try:
+    iter_unpack_events = event_struct.iter_unpack
+except AttributeError:
+    # Python 2 has no `iter_unpack`.
+    def iter_unpack_events(buffer):
+        for offset in range(0, len(buffer), event_size):
+            yield event_struct.unpack_from(buffer, offset)
 
 # Taken from include/linux/input.h
 # https://www.kernel.org/doc/Documentation/input/event-codes.txt
@@ -20,45 +52,128 @@ EV_REL = 0x02
 EV_ABS = 0x03
 EV_MSC = 0x04
 
+SYN_REPORT = 0x00
+SYN_DROPPED = 0x03
+
+KEY_MAX = 0x2ff
+
+def _IOC(direction, type, number, size):
+    # Equivalent to the _IOC macro from include/uapi/asm-generic/ioctl.h.
+    return (direction << 30) | (size << 16) | (ord(type) << 8) | number
+_IOC_WRITE = 1
+_IOC_READ = 2
+
+def EVIOCGKEY(length):
+    return _IOC(_IOC_READ, 'E', 0x18, length)
+EVIOCGRAB = _IOC(_IOC_WRITE, 'E', 0x90, struct.calcsize('i'))
+EVIOCSCLOCKID = _IOC(_IOC_WRITE, 'E', 0xa0, struct.calcsize('i'))
+
+# Taken from include/uapi/linux/time.h, for EVIOCSCLOCKID.
+CLOCK_REALTIME = 0
+CLOCK_MONOTONIC = 1
+
+def EVIOCGNAME(length):
+    return _IOC(_IOC_READ, 'E', 0x06, length)
+
+def EVIOCGPHYS(length):
+    return _IOC(_IOC_READ, 'E', 0x07, length)
+
+def EVIOCGBIT(type, length):
+    return _IOC(_IOC_READ, 'E', 0x20 + type, length)
+
+def UI_GET_SYSNAME(length):
+    return _IOC(_IOC_READ, 'U', 44, length)
+
+def bits_set(bitmap):
+    """ Returns the indexes of the bits set in a little-endian bitmap. """
+    return [i * 8 + bit for i, byte in enumerate(bitmap) if byte for bit in range(8) if byte >> bit & 1]
+
+# Passed to device listeners when keyboards and mice are plugged in and out.
+DEVICE_ADDED = 'added'
+DEVICE_REMOVED = 'removed'
+
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+# struct uinput_setup: input_id (bustype, vendor, product, version), name,
+# ff_effects_max.
+uinput_setup = struct.Struct('HHHH80sI')
+UI_DEV_SETUP = _IOC(_IOC_WRITE, 'U', 3, uinput_setup.size)
+
 def make_uinput():
     if not os.path.exists('/dev/uinput'):
         raise IOError('No uinput module found.')
 
-    import fcntl, struct
+    import fcntl
 
     # Requires uinput driver, but it's usually available.
     uinput = open("/dev/uinput", 'wb')
-    UI_SET_EVBIT = 0x40045564
-    fcntl.ioctl(uinput, UI_SET_EVBIT, EV_KEY)
-
-    UI_SET_KEYBIT = 0x40045565
+    fd = uinput.fileno()
+    ioctl = fcntl.ioctl
+    ioctl(fd, UI_SET_EVBIT, EV_KEY)
     for i in range(256):
-        fcntl.ioctl(uinput, UI_SET_KEYBIT, i)
+        ioctl(fd, UI_SET_KEYBIT, i)
 
     BUS_USB = 0x03
-    uinput_user_dev = "80sHHHHi64i64i64i64i"
-    axis = [0] * 64 * 4
-    uinput.write(struct.pack(uinput_user_dev, b"Virtual Keyboard", BUS_USB, 1, 1, 1, 0, *axis))
-    uinput.flush() # Without this you may get Errno 22: Invalid argument.
+    try:
+        # Linux 4.5+. Avoids writing the legacy struct with all the axis info.
+        ioctl(fd, UI_DEV_SETUP, uinput_setup.pack(BUS_USB, 1, 1, 1, b"Virtual Keyboard", 0))
+    except (IOError, OSError):
+        uinput_user_dev = "80sHHHHi64i64i64i64i"
+        axis = [0] * 64 * 4
+        uinput.write(struct.pack(uinput_user_dev, b"Virtual Keyboard", BUS_USB, 1, 1, 1, 0, *axis))
+        uinput.flush() # Without this you may get Errno 22: Invalid argument.
 
-    UI_DEV_CREATE = 0x5501
-    fcntl.ioctl(uinput, UI_DEV_CREATE)
-    UI_DEV_DESTROY = 0x5502
-    #fcntl.ioctl(uinput, UI_DEV_DESTROY)
+    ioctl(fd, UI_DEV_CREATE)
+    #ioctl(fd, UI_DEV_DESTROY)
 
     return uinput
 
+def uinput_event_path(uinput):
+    """
+    Returns the event file (e.g. '/dev/input/event7') of the device created by
+    `make_uinput`, or None if the kernel can't tell (older than 3.15).
+    """
+    import fcntl
+    sysname = bytearray(64)
+    try:
+        fcntl.ioctl(uinput, UI_GET_SYSNAME(len(sysname)), sysname)
+    except (IOError, OSError):
+        return None
+    sysname = bytes(sysname).rstrip(b'\0').decode('utf-8')
+    for path in glob('/sys/devices/virtual/input/{}/event*'.format(sysname)):
+        return '/dev/input/' + os.path.basename(path)
+
+def set_nonblocking(file):
+    """
+    Makes reads on the given file return immediately instead of blocking when
+    no data is available. Used when multiplexing many devices.
+    """
+    import fcntl
+    fd = file.fileno()
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
 class EventDevice(object):
     def __init__(self, path):
         self.path = path
         self._input_file = None
         self._output_file = None
+        self._read_buffer = bytearray(event_size * events_per_read)
+        self._pending_events = deque()
+        self._write_lock = Lock()
+        # Events being batched, per thread. See `batch`.
+        self._batch = local()
 
     @property
     def input_file(self):
         if self._input_file is None:
             try:
-                self._input_file = open(self.path, 'rb')
+                # Unbuffered, so that each `readinto` is exactly one syscall
+                # returning whatever the kernel has queued. Python 2's `open`
+                # would keep reading until the whole buffer is filled.
+                self._input_file = io.open(self.path, 'rb', buffering=0)
             except IOError as e:
                 if e.strerror == 'Permission denied':
                     print("# ERROR: Failed to read device '{}'. You must be in the 'input' group to access global events. Use 'sudo usermod -a -G input USERNAME' to add user to the required group.".format(self.path))
@@ -79,74 +194,587 @@ class EventDevice(object):
             atexit.register(self._output_file.close)
         return self._output_file
 
+    def read_events(self):
+        """
+        Reads all events queued by the kernel (up to `events_per_read`) with a
+        single syscall, blocking until at least one is available. Returns a
+        list of `(time, type, code, value, device)` tuples.
+        """
+        size = self.input_file.readinto(self._read_buffer)
+        if not size:
+            return []
+        # The kernel only returns whole events, but better safe than sorry.
+        size -= size % event_size
+        path = self.path
+        return [
+            (seconds + microseconds / 1e6, type, code, value, path)
+            for seconds, microseconds, type, code, value
+            in iter_unpack_events(memoryview(self._read_buffer)[:size])
+        ]
+
     def read_event(self):
-        data = self.input_file.read(struct.calcsize(event_bin_format))
-        seconds, microseconds, type, code, value = struct.unpack(event_bin_format, data)
-        return seconds + microseconds / 1e6, type, code, value, self.path
+        while not self._pending_events:
+            self._pending_events.extend(self.read_events())
+        return self._pending_events.popleft()
+
+    def grab(self, enabled=True):
+        """
+        Grabs the device (EVIOCGRAB), so that its events are delivered only to
+        us and not to other programs, or releases it.
+        """
+        import fcntl
+        fcntl.ioctl(self.input_file, EVIOCGRAB, int(enabled))
+
+    def set_clock(self, clock_id):
+        """
+        Chooses the clock used to timestamp the events read from this device
+        (EVIOCSCLOCKID), e.g. CLOCK_MONOTONIC instead of the default
+        CLOCK_REALTIME. Only affects our own file descriptor.
+        """
+        import fcntl
+        fcntl.ioctl(self.input_file, EVIOCSCLOCKID, struct.pack('i', clock_id))
+
+    def get_info(self):
+        """
+        Queries the kernel for the device name, phys path and key capabilities
+        (EVIOCGBIT), returning a DeviceInfo.
+        """
+        import fcntl
+        def query(request, length=256):
+            buffer = bytearray(length)
+            try:
+                fcntl.ioctl(self.input_file, request(length), buffer)
+            except (IOError, OSError):
+                return None
+            return buffer
+        name = query(EVIOCGNAME)
+        phys = query(EVIOCGPHYS)
+        key_bits = query(lambda length: EVIOCGBIT(EV_KEY, length), (KEY_MAX + 1) // 8)
+        to_str = lambda buffer: bytes(buffer or b'').split(b'\0')[0].decode('utf-8', 'replace')
+        return DeviceInfo(self.path, to_str(name), to_str(phys), '', None if key_bits is None else set(bits_set(key_bits)))
+
+    def get_pressed_keys(self):
+        """
+        Queries the kernel (EVIOCGKEY) for the keys currently held down on this
+        device. Returns a list of `(code, device)` tuples.
+        """
+        import fcntl
+        bitmap = bytearray((KEY_MAX + 1) // 8)
+        fcntl.ioctl(self.input_file, EVIOCGKEY(len(bitmap)), bitmap)
+        return [(code, self.path) for code in bits_set(bitmap)]
 
     def write_event(self, type, code, value):
+        """
+        Sends an event, followed by a sync event so other programs update. If
+        called inside `batch`, the event is only written when the batch ends.
+        """
+        batch = self._batch
+        if not getattr(batch, 'depth', 0):
+            self._write_frames([(type, code, value)])
+            return
+
+        # A key cannot be pressed and released in the same frame, so only
+        # start a new frame when the same code is repeated.
+        repeated = (type, code) in batch.frame_codes
+        # Counting the syncs starting this frame and ending the write.
+        if len(batch.events) + repeated + 2 > records_per_write:
+            self.flush()
+        elif repeated:
+            batch.events.append((EV_SYN, 0, 0))
+            batch.frame_codes.clear()
+        batch.frame_codes.add((type, code))
+        batch.events.append((type, code, value))
+
+    @contextmanager
+    def batch(self):
+        """
+        Collects all events written by this thread inside the `with` block and
+        sends them when the outermost batch exits, with sync events only
+        between frames, in writes of up to `records_per_write` records. Yields the device, whose `flush`
+        method sends the events collected so far (e.g. before sleeping).
+        """
+        batch = self._batch
+        if not getattr(batch, 'depth', 0):
+            batch.depth = 0
+            batch.events = []
+            batch.frame_codes = set()
+        batch.depth += 1
+        try:
+            yield self
+        finally:
+            batch.depth -= 1
+            if not batch.depth:
+                self.flush()
+
+    def flush(self):
+        """
+        Sends the events batched by this thread so far.
+        """
+        batch = self._batch
+        events = getattr(batch, 'events', None)
+        if events:
+            self._write_frames(events)
+            del events[:]
+            batch.frame_codes.clear()
+
+    def _write_frames(self, events):
         integer, fraction = divmod(now(), 1)
         seconds = int(integer)
         microseconds = int(fraction * 1e6)
-        data_event = struct.pack(event_bin_format, seconds, microseconds, type, code, value)
+        pack = event_struct.pack
+        data = b''.join(pack(seconds, microseconds, type, code, value) for type, code, value in events)
+        if events[-1][0] != EV_SYN:
+            # Send a sync event to ensure other programs update.
+            data += pack(seconds, microseconds, EV_SYN, 0, 0)
+
+        with self._write_lock:
+            self.output_file.write(data)
+            self.output_file.flush()
+
+# Seconds between creating a uinput device and writing to it. X, libinput and
+# other readers only open the new device after udev announces it, and miss the
+# events sent before. Same pause as in the kernel's uinput documentation.
+uinput_settle_time = 1
+
+class UinputDevice(EventDevice):
+    """
+    Virtual keyboard used to send events. The uinput device is created by
+    `create`, or when the first event is written, so programs that only use
+    `aggregate_devices` to read never create one. Its `path` becomes the real
+    event file once created.
+    """
+    def __init__(self):
+        EventDevice.__init__(self, 'uinput Fake Device')
+        self._create_lock = Lock()
+        self._created_at = None
+
+    def create(self):
+        """
+        Creates the uinput device, if not created yet, without waiting for
+        other programs to open it.
+        """
+        with self._create_lock:
+            if self._output_file is None:
+                uinput = make_uinput()
+                self.path = uinput_event_path(uinput) or self.path
+                self._created_at = now()
+                self._input_file = uinput
+                self._output_file = uinput
+
+    @property
+    def output_file(self):
+        if self._output_file is None:
+            self.create()
+        if self._created_at is not None:
+            # Only the first writes may have to wait.
+            delay = self._created_at + uinput_settle_time - now()
+            if delay > 0:
+                sleep(delay)
+            else:
+                self._created_at = None
+        return self._output_file
+
+class DeviceWatcher(object):
+    """
+    Uses inotify (through libc, via ctypes) to report event files created and
+    removed in `/dev/input`. Creation is reported again when the file
+    attributes change, because udev only fixes the permissions of new device
+    files after they are created.
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    header = struct.Struct('iIII')
 
-        # Send a sync event to ensure other programs update.
-        sync_event = struct.pack(event_bin_format, seconds, microseconds, EV_SYN, 0, 0)
+    def __init__(self, directory='/dev/input'):
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init()
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'Failed to initialize inotify.')
+        mask = self.IN_ATTRIB | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(fd, directory.encode('utf-8'), mask) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), 'Failed to watch {}.'.format(directory))
+        self.directory = directory
+        # A FileIO, so each `readinto` returns the records already queued.
+        self.input_file = io.open(fd, 'rb', buffering=0)
+        atexit.register(self.input_file.close)
+        self._read_buffer = bytearray(4096)
 
-        self.output_file.write(data_event + sync_event)
-        self.output_file.flush()
+    def read_changes(self):
+        """
+        Returns a list of `(action, path)` tuples for the event files created
+        (`DEVICE_ADDED`) or deleted (`DEVICE_REMOVED`) since the last call.
+        """
+        size = self.input_file.readinto(self._read_buffer)
+        changes = []
+        offset = 0
+        while offset < (size or 0):
+            wd, mask, cookie, length = self.header.unpack_from(self._read_buffer, offset)
+            offset += self.header.size
+            name = bytes(self._read_buffer[offset:offset + length]).rstrip(b'\0').decode('utf-8')
+            offset += length
+            if not re.match(r'event\d+$', name):
+                continue
+            action = DEVICE_REMOVED if mask & self.IN_DELETE else DEVICE_ADDED
+            changes.append((action, os.path.join(self.directory, name)))
+        return changes
 
 class AggregatedEventDevice(object):
-    def __init__(self, devices, output=None):
-        self.event_queue = Queue()
-        self.devices = devices
+    """
+    Merges the events of many devices into a single stream. By default all
+    devices are served from the thread calling `read_events`, multiplexed with
+    `selectors` (epoll) over non-blocking file descriptors. If `use_threads` is
+    true, or `selectors` is not available, each device is instead read by its
+    own daemon thread and events are handed over through a queue.
+
+    If `hotplug_type` is given (e.g. 'kbd'), `/dev/input` is watched and
+    devices of that type are added and removed as they are plugged in and out.
+    Each change is reported to the functions in `device_listeners` as
+    `listener(action, path)`.
+
+    `list_devices` is a function that takes a device filter and returns the
+    devices passing it, used by `set_device_filter`. Defaults to the devices
+    of `hotplug_type` in /proc/bus/input/devices.
+
+    If `grab` is set (see `set_grab`), devices are grabbed so other programs
+    don't see their events, and the reader is responsible for re-sending the
+    accepted ones through `output`.
+    """
+    def __init__(self, devices, output=None, use_threads=None, hotplug_type=None, device_filter=None, list_devices=None):
+        self._pending_events = deque()
+        self.devices = list(devices)
         self.output = output or self.devices[0]
-        def start_reading(device):
-            while True:
-                self.event_queue.put(device.read_event())
+        self.device_listeners = []
+        self.grab = False
+        self.grabbed = set()
+        self.clock_id = None
+        self.use_threads = use_threads or selectors is None
+        if self.use_threads:
+            self.event_queue = Queue()
+        else:
+            self.selector = selectors.DefaultSelector()
         for device in self.devices:
-            thread = Thread(target=start_reading, args=[device])
+            self._start_reading(device)
+
+        self.hotplug_type = hotplug_type
+        self.device_filter = device_filter
+        if list_devices is None and hotplug_type:
+            list_devices = lambda device_filter: list_devices_from_proc(hotplug_type, device_filter)
+        self.list_devices = list_devices
+        self.watcher = None
+        if hotplug_type:
+            try:
+                self.watcher = DeviceWatcher()
+            except (IOError, OSError):
+                import warnings
+                warnings.warn('Failed to watch /dev/input for new devices. Devices plugged in later will be ignored.', stacklevel=2)
+        if self.watcher and self.use_threads:
+            def watch():
+                while True:
+                    self._apply_changes(self.watcher.read_changes())
+            thread = Thread(target=watch)
             thread.daemon = True
             thread.start()
+        elif self.watcher:
+            set_nonblocking(self.watcher.input_file)
+            self.selector.register(self.watcher.input_file, selectors.EVENT_READ, self.watcher)
+
+    def _start_reading(self, device):
+        if not self.use_threads:
+            set_nonblocking(device.input_file)
+            self.selector.register(device.input_file, selectors.EVENT_READ, device)
+            return
+
+        def start_reading():
+            while device in self.devices:
+                try:
+                    events = device.read_events()
+                except (IOError, OSError):
+                    # Usually ENODEV, the device was unplugged.
+                    self.remove_device(device.path)
+                    break
+                except ValueError:
+                    # Closed by `remove_device` from another thread.
+                    break
+                if events:
+                    self.event_queue.put(events)
+        thread = Thread(target=start_reading)
+        thread.daemon = True
+        thread.start()
+
+    def _notify(self, action, path):
+        for listener in list(self.device_listeners):
+            try:
+                listener(action, path)
+            except Exception:
+                traceback.print_exc()
+
+    def add_device(self, device):
+        """
+        Starts reading events from the given `EventDevice`, which must have
+        its input file already open.
+        """
+        if any(d.path == device.path for d in self.devices):
+            return
+        self.devices.append(device)
+        self._start_reading(device)
+        self._notify(DEVICE_ADDED, device.path)
+
+    def remove_device(self, path):
+        """
+        Stops reading events from the device with the given path, if any.
+        """
+        for device in list(self.devices):
+            if device.path != path:
+                continue
+            self.devices.remove(device)
+            self.grabbed.discard(path)
+            if not self.use_threads:
+                self.selector.unregister(device.input_file)
+            try:
+                device.input_file.close()
+            except (IOError, OSError):
+                pass
+            self._notify(DEVICE_REMOVED, path)
+
+    def _apply_changes(self, changes):
+        if not changes:
+            return
+        wanted = set(device.path for device in list_devices_from_proc(self.hotplug_type, self.device_filter))
+        for action, path in changes:
+            if action == DEVICE_REMOVED:
+                self.remove_device(path)
+            elif path in wanted:
+                # If not readable yet, udev will change the permissions and
+                # trigger another event.
+                self._open_device(path)
+
+    def _open_device(self, path):
+        if any(d.path == path for d in self.devices):
+            return
+        device = EventDevice(path)
+        try:
+            device._input_file = io.open(path, 'rb', buffering=0)
+            if self.clock_id is not None:
+                device.set_clock(self.clock_id)
+        except (IOError, OSError):
+            return
+        self.add_device(device)
+
+    def read_events(self):
+        """
+        Blocks until any device has events, then returns them as a list.
+        """
+        if self.use_threads:
+            return self.event_queue.get(block=True)
+
+        while True:
+            events = []
+            for key, mask in self.selector.select():
+                if key.data is self.watcher:
+                    self._apply_changes(self.watcher.read_changes())
+                    continue
+                try:
+                    events.extend(key.data.read_events())
+                except (IOError, OSError):
+                    # Usually ENODEV, the device was unplugged.
+                    self.remove_device(key.data.path)
+                except ValueError:
+                    # Closed by `remove_device` from another thread.
+                    pass
+            if events:
+                return events
 
     def read_event(self):
-        return self.event_queue.get(block=True)
+        while not self._pending_events:
+            self._pending_events.extend(self.read_events())
+        return self._pending_events.popleft()
+
+    def set_device_filter(self, device_filter):
+        """
+        Replaces the filter of which devices to use, dropping the devices that
+        don't pass it anymore and adding the ones that now do.
+        """
+        if self.list_devices is None:
+            raise NotImplementedError('Cannot filter devices that were not listed by type, see `list_devices`.')
+        self.device_filter = device_filter
+        wanted = [device.path for device in self.list_devices(device_filter)]
+        for device in list(self.devices):
+            if device.path not in wanted and device.path != self.output.path:
+                self.remove_device(device.path)
+        for path in wanted:
+            self._open_device(path)
+
+    def set_grab(self, enabled):
+        """
+        Enables or disables exclusive grab mode. Devices are grabbed by
+        `try_grab`, as soon as they have no keys held down. Requires `output`
+        to be a uinput device whose events can be told apart.
+        """
+        if enabled and isinstance(self.output, UinputDevice):
+            # Create it now, so we know which events are our own.
+            self.output.create()
+        if enabled and not self.output.path.startswith('/dev/input/event'):
+            raise IOError('Exclusive grab requires a uinput device to re-send the accepted events.')
+        self.grab = enabled
+        if not enabled:
+            for path in list(self.grabbed):
+                self.grabbed.discard(path)
+                for device in self.devices:
+                    if device.path == path:
+                        device.grab(False)
+
+    def create_output(self):
+        """
+        Creates the uinput `output` device now, instead of on the first write,
+        so other programs have opened it by the time events are sent.
+        """
+        if isinstance(self.output, UinputDevice):
+            try:
+                self.output.create()
+            except (IOError, OSError):
+                # Raised again when sending, if it still fails.
+                pass
+
+    def set_clock(self, clock_id):
+        """
+        Timestamps the events of all devices, including the ones plugged in
+        later, with the given clock (see `EventDevice.set_clock`).
+        """
+        self.clock_id = clock_id
+        for device in list(self.devices):
+            device.set_clock(clock_id)
+
+    def try_grab(self, path):
+        """
+        Grabs the device with the given path, unless it has keys held down:
+        their releases would never reach other programs, leaving them stuck.
+        Our own output device is never grabbed.
+        """
+        if path == self.output.path:
+            return
+        for device in list(self.devices):
+            if device.path != path:
+                continue
+            try:
+                if not device.get_pressed_keys():
+                    device.grab()
+                    self.grabbed.add(path)
+            except (IOError, OSError):
+                pass
+
+    def get_pressed_keys(self):
+        """
+        Returns a list of `(code, device)` tuples for the keys currently held
+        down on all devices.
+        """
+        pressed = []
+        for device in list(self.devices):
+            if self.grab and device.path == self.output.path:
+                # Only mirrors the grabbed devices.
+                continue
+            try:
+                pressed.extend(device.get_pressed_keys())
+            except (IOError, OSError):
+                pass
+        return pressed
 
     def write_event(self, type, code, value):
         self.output.write_event(type, code, value)
 
-import re
+    def batch(self):
+        return self.output.batch()
+
 from collections import namedtuple
 DeviceDescription = namedtuple('DeviceDescription', 'event_file is_mouse is_keyboard')
-device_pattern = r"""N: Name="([^"]+?)".+?H: Handlers=([^\n]+)"""
-def list_devices_from_proc(type_name):
+# `key_codes` is the set of EV_KEY codes the device can send, or None if
+# unknown.
+DeviceInfo = namedtuple('DeviceInfo', 'path name phys handlers key_codes')
+
+def parse_bitmap(hex_words):
+    """
+    Parses a capability bitmap as shown in /proc/bus/input/devices (e.g.
+    "B: KEY=1000000000007 ff9f207ac14057ff"), most significant word first.
+    """
+    bits_per_word = struct.calcsize('l') * 8
+    codes = set()
+    for i, word in enumerate(reversed(hex_words.split())):
+        value = int(word, 16)
+        codes.update(i * bits_per_word + bit for bit in range(bits_per_word) if value >> bit & 1)
+    return codes
+
+def list_device_info():
     try:
         with open('/proc/bus/input/devices') as f:
             description = f.read()
-    except FileNotFoundError:
+    except (IOError, OSError):
         return
 
-    devices = {}
-    for name, handlers in re.findall(device_pattern, description, re.DOTALL):
-        path = '/dev/input/event' + re.search(r'event(\d+)', handlers).group(1)
-        if type_name in handlers:
-            yield EventDevice(path)
+    for block in description.split('\n\n'):
+        fields = dict(re.findall(r'^\w: (\w+)=(.*)$', block, re.MULTILINE))
+        event = re.search(r'event(\d+)', fields.get('Handlers', ''))
+        if not event:
+            continue
+        key_codes = parse_bitmap(fields['KEY']) if 'KEY' in fields else set()
+        yield DeviceInfo('/dev/input/event' + event.group(1), fields.get('Name', '').strip('"'), fields.get('Phys', ''), fields['Handlers'], key_codes)
+
+# Letters of a QWERTY layout, KEY_Q..KEY_P, KEY_A..KEY_L and KEY_Z..KEY_M.
+letter_key_codes = set(range(16, 26)) | set(range(30, 39)) | set(range(44, 51))
+def is_keyboard(info):
+    """
+    Returns True if the device can type letters. Keeps out devices that have a
+    keyboard handler but only a few special keys, such as power buttons, lid
+    switches, HDMI CEC and webcam buttons.
+    """
+    return info.key_codes is None or bool(info.key_codes & letter_key_codes)
 
-def list_devices_from_by_id(name_suffix, by_id=True):
+def make_device_filter(include=None, exclude=None, keyboards_only=True):
+    """
+    Returns a function that takes a DeviceInfo and decides if the device
+    should be used. `include` and `exclude` are lists of patterns, each
+    either a glob matched against the device name, phys path and event file,
+    or a function taking the DeviceInfo. If `include` is given, only devices
+    matching one of its patterns are used. If `keyboards_only`, devices
+    without letter keys are skipped (see `is_keyboard`).
+    """
+    def matches(info, pattern):
+        if callable(pattern):
+            return pattern(info)
+        return any(fnmatch(value, pattern) for value in (info.name, info.phys, info.path))
+
+    def device_filter(info):
+        if keyboards_only and not is_keyboard(info):
+            return False
+        if include is not None and not any(matches(info, pattern) for pattern in include):
+            return False
+        return not any(matches(info, pattern) for pattern in exclude or ())
+    return device_filter
+
+# Default filter by device type, see `aggregate_devices`.
+device_filters = {'kbd': make_device_filter()}
+
+def list_devices_from_proc(type_name, device_filter=None):
+    for info in list_device_info():
+        if type_name in info.handlers and (device_filter is None or device_filter(info)):
+            yield EventDevice(info.path)
+
+def list_devices_from_by_id(name_suffix, by_id=True, device_filter=None):
     for path in glob('/dev/input/{}/*-event-{}'.format('by-id' if by_id else 'by-path', name_suffix)):
-        yield EventDevice(path)
+        device = EventDevice(path)
+        if device_filter is None or device_filter(device.get_info()):
+            yield device
 
 def aggregate_devices(type_name):
     # Some systems have multiple keyboards with different range of allowed keys
     # on each one, like a notebook with a "keyboard" device exclusive for the
     # power button. Instead of figuring out which keyboard allows which key to
     # send events, we create a fake device and send all events through there.
-    try:
-        uinput = make_uinput()
-        fake_device = EventDevice('uinput Fake Device')
-        fake_device._input_file = uinput
-        fake_device._output_file = uinput
-    except IOError as e:
+    # The device is only created when the first event is sent.
+    if os.access('/dev/uinput', os.W_OK):
+        fake_device = UinputDevice()
+    else:
         import warnings
         warnings.warn('Failed to create a device file using `uinput` module. Sending of events may be limited or unavailable depending on plugged-in devices.', stacklevel=2)
         fake_device = None
@@ -154,16 +782,19 @@ def aggregate_devices(type_name):
     # We don't aggregate devices from different sources to avoid
     # duplicates.
 
-    devices_from_proc = list(list_devices_from_proc(type_name))
+    device_filter = device_filters.get(type_name)
+    devices_from_proc = list(list_devices_from_proc(type_name, device_filter))
     if devices_from_proc:
-        return AggregatedEventDevice(devices_from_proc, output=fake_device)
+        return AggregatedEventDevice(devices_from_proc, output=fake_device, hotplug_type=type_name, device_filter=device_filter)
 
     # breaks on mouse for virtualbox
     # was getting /dev/input/by-id/usb-VirtualBox_USB_Tablet-event-mouse
-    devices_from_by_id = list(list_devices_from_by_id(type_name)) or list(list_devices_from_by_id(type_name, by_id=False))
+    list_devices = lambda device_filter: list(list_devices_from_by_id(type_name, device_filter=device_filter)) or list(list_devices_from_by_id(type_name, by_id=False, device_filter=device_filter))
+    devices_from_by_id = list_devices(device_filter)
     if devices_from_by_id:
-        return AggregatedEventDevice(devices_from_by_id, output=fake_device)
+        return AggregatedEventDevice(devices_from_by_id, output=fake_device, list_devices=list_devices)
 
-    # If no keyboards were found we can only use the fake device to send keys.
+    # If no keyboards were found we can only use the fake device to send keys,
+    # but keep watching in case one is plugged in later.
     assert fake_device
-    return fake_device
+    return AggregatedEventDevice([], output=fake_device, hotplug_type=type_name, device_filter=device_filter)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the evdev plumbing. Devices read from pipes and write to in-memory
+files, so no real input device is needed.
+"""
+import os
+import io
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+
+from . import _nixcommon
+from ._nixcommon import EventDevice, AggregatedEventDevice, event_struct, iter_unpack_events, EV_KEY, EV_SYN, EV_MSC
+
+def pipe_device(path):
+    """ Returns an `EventDevice` reading from a new pipe, and the pipe's write end. """
+    read_fd, write_fd = os.pipe()
+    device = EventDevice(path)
+    device._input_file = io.open(read_fd, 'rb', buffering=0)
+    return device, os.fdopen(write_fd, 'wb', 0)
+
+class RecordingOutput(io.BytesIO):
+    """ In-memory output file that records how many records each `write` had. """
+    def __init__(self):
+        io.BytesIO.__init__(self)
+        self.sizes = []
+    @property
+    def writes(self):
+        return len(self.sizes)
+    def write(self, data):
+        self.sizes.append(len(data) // event_struct.size)
+        return io.BytesIO.write(self, data)
+
+class TestEventDevice(unittest.TestCase):
+    def setUp(self):
+        self.device = EventDevice('/dev/input/event99')
+        self.output = self.device._output_file = RecordingOutput()
+
+    def records(self):
+        """ Returns the `(type, code, value)` of the records written so far. """
+        return [record[2:] for record in iter_unpack_events(self.output.getvalue())]
+
+    def test_read_partial_batch(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'event0')
+        os.mkfifo(path)
+        # Opened for writing first, so opening it for reading doesn't block.
+        writer = os.open(path, os.O_RDWR)
+        self.addCleanup(os.close, writer)
+        device = EventDevice(path)
+        self.addCleanup(device.input_file.close)
+        os.write(writer, event_struct.pack(1, 0, EV_KEY, 30, 1) + event_struct.pack(1, 0, EV_SYN, 0, 0))
+
+        # Fewer events than `events_per_read` are returned right away.
+        events = []
+        thread = Thread(target=lambda: events.extend(device.read_events()))
+        thread.daemon = True
+        thread.start()
+        thread.join(1)
+        self.assertEqual([event[1:4] for event in events], [(EV_KEY, 30, 1), (EV_SYN, 0, 0)])
+
+    def test_write_event(self):
+        self.device.write_event(EV_KEY, 30, 1)
+        self.device.write_event(EV_KEY, 30, 0)
+        self.assertEqual(self.records(), [(EV_KEY, 30, 1), (EV_SYN, 0, 0), (EV_KEY, 30, 0), (EV_SYN, 0, 0)])
+        self.assertEqual(self.output.writes, 2)
+
+    def test_batch_frames(self):
+        with self.device.batch():
+            self.device.write_event(EV_KEY, 42, 1)
+            self.device.write_event(EV_KEY, 30, 1)
+            # Same code as before, starts a new frame.
+            self.device.write_event(EV_KEY, 30, 0)
+            self.device.write_event(EV_KEY, 42, 0)
+            # Different type, same code, same frame.
+            self.device.write_event(EV_MSC, 42, 7)
+            self.assertEqual(self.output.writes, 0)
+        self.assertEqual(self.records(), [
+            (EV_KEY, 42, 1), (EV_KEY, 30, 1), (EV_SYN, 0, 0),
+            (EV_KEY, 30, 0), (EV_KEY, 42, 0), (EV_MSC, 42, 7), (EV_SYN, 0, 0),
+        ])
+        self.assertEqual(self.output.writes, 1)
+
+    def test_batch_nested(self):
+        with self.device.batch():
+            self.device.write_event(EV_KEY, 30, 1)
+            with self.device.batch():
+                # Still in the frame of the outer batch.
+                self.device.write_event(EV_KEY, 48, 1)
+                self.device.write_event(EV_KEY, 30, 0)
+            self.assertEqual(self.output.writes, 0)
+            self.device.write_event(EV_KEY, 48, 0)
+        self.assertEqual(self.records(), [
+            (EV_KEY, 30, 1), (EV_KEY, 48, 1), (EV_SYN, 0, 0),
+            (EV_KEY, 30, 0), (EV_KEY, 48, 0), (EV_SYN, 0, 0),
+        ])
+        self.assertEqual(self.output.writes, 1)
+
+    def test_batch_size_limit(self):
+        with self.device.batch():
+            for i in range(40):
+                self.device.write_event(EV_KEY, 30, 1)
+                self.device.write_event(EV_KEY, 30, 0)
+        expected = []
+        for i in range(40):
+            expected += [(EV_KEY, 30, 1), (EV_SYN, 0, 0), (EV_KEY, 30, 0), (EV_SYN, 0, 0)]
+        self.assertEqual(self.records(), expected)
+        # Split between frames, each write ending with a sync.
+        self.assertEqual(self.output.sizes, [_nixcommon.records_per_write] * 5)
+
+    def test_batch_flush(self):
+        with self.device.batch() as batch:
+            self.device.write_event(EV_KEY, 30, 1)
+            batch.flush()
+            self.assertEqual(self.records(), [(EV_KEY, 30, 1), (EV_SYN, 0, 0)])
+            # A new frame, even though the code is the same.
+            self.device.write_event(EV_KEY, 30, 0)
+        self.assertEqual(self.records(), [(EV_KEY, 30, 1), (EV_SYN, 0, 0), (EV_KEY, 30, 0), (EV_SYN, 0, 0)])
+        self.assertEqual(self.output.writes, 2)
+        # Nothing left to send.
+        self.device.flush()
+        self.assertEqual(self.output.writes, 2)
+
+class TestUinputDevice(unittest.TestCase):
+    def setUp(self):
+        self.clock = [100.0]
+        self.sleeps = []
+        self.created = []
+        def make_uinput():
+            self.created.append(self.clock[0])
+            return RecordingOutput()
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            self.clock[0] += seconds
+        replacements = {
+            'make_uinput': make_uinput,
+            'uinput_event_path': lambda uinput: '/dev/input/event42',
+            'now': lambda: self.clock[0],
+            'sleep': sleep,
+        }
+        for name, value in replacements.items():
+            self.addCleanup(setattr, _nixcommon, name, getattr(_nixcommon, name))
+            setattr(_nixcommon, name, value)
+        self.device = _nixcommon.UinputDevice()
+
+    def test_first_write_waits(self):
+        self.device.write_event(EV_KEY, 30, 1)
+        self.assertEqual(self.created, [100.0])
+        self.assertEqual(self.sleeps, [_nixcommon.uinput_settle_time])
+        self.assertEqual(self.device.path, '/dev/input/event42')
+        self.device.write_event(EV_KEY, 30, 0)
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertEqual(self.device.output_file.writes, 2)
+
+    def test_created_early(self):
+        self.device.create()
+        self.device.create()
+        self.assertEqual(self.created, [100.0])
+        self.clock[0] += 0.25
+        self.device.write_event(EV_KEY, 30, 1)
+        # Only waits for the rest of the settle time.
+        self.assertEqual(self.sleeps, [_nixcommon.uinput_settle_time - 0.25])
+
+    def test_created_long_before(self):
+        self.device.create()
+        self.clock[0] += 60
+        self.device.write_event(EV_KEY, 30, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_aggregated_create_output(self):
+        aggregated = AggregatedEventDevice([], output=self.device, use_threads=True)
+        aggregated.create_output()
+        self.assertEqual(self.created, [100.0])
+        self.assertEqual(self.device.path, '/dev/input/event42')
+
+class TestDeviceWatcher(unittest.TestCase):
+    def test_read_changes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        try:
+            watcher = _nixcommon.DeviceWatcher(directory)
+        except (IOError, OSError):
+            self.skipTest('inotify is not available.')
+        self.addCleanup(watcher.input_file.close)
+        path = os.path.join(directory, 'event3')
+        open(path, 'w').close()
+        open(os.path.join(directory, 'js0'), 'w').close()
+        os.remove(path)
+
+        # Returns the few records queued without waiting for more.
+        changes = []
+        thread = Thread(target=lambda: changes.extend(watcher.read_changes()))
+        thread.daemon = True
+        thread.start()
+        thread.join(1)
+        self.assertEqual(changes, [(_nixcommon.DEVICE_ADDED, path), (_nixcommon.DEVICE_REMOVED, path)])
+
+class FakeUinput(object):
+    path = '/dev/input/event99'
+
+@unittest.skipIf(_nixcommon.selectors is None, 'Requires the selectors module.')
+class TestAggregatedEventDevice(unittest.TestCase):
+    def setUp(self):
+        self.devices = {}
+        self.writers = []
+        for path in ['/dev/input/by-id/kbd-a-event-kbd', '/dev/input/by-id/kbd-b-event-kbd']:
+            device, writer = pipe_device(path)
+            self.devices[path] = device
+            self.writers.append(writer)
+            self.addCleanup(writer.close)
+            self.addCleanup(device.input_file.close)
+
+    def aggregate(self, **kwargs):
+        return AggregatedEventDevice(list(self.devices.values()), output=FakeUinput(), use_threads=False, **kwargs)
+
+    def test_read_events_survives_closed_device(self):
+        aggregated = self.aggregate()
+        closed = self.devices['/dev/input/by-id/kbd-a-event-kbd']
+        def read_closed():
+            # As if `remove_device` closed it while we were in `select`.
+            raise ValueError('I/O operation on closed file.')
+        closed.read_events = read_closed
+        for writer in self.writers:
+            writer.write(event_struct.pack(1, 0, EV_KEY, 30, 1))
+        events = aggregated.read_events()
+        self.assertEqual([event[1:] for event in events], [(EV_KEY, 30, 1, '/dev/input/by-id/kbd-b-event-kbd')])
+
+    def test_set_device_filter_by_id(self):
+        listed = []
+        def list_devices(device_filter):
+            listed.append(device_filter)
+            return [device for path, device in self.devices.items() if device_filter(path)]
+        aggregated = self.aggregate(list_devices=list_devices)
+        device_filter = lambda path: path.endswith('b-event-kbd')
+        aggregated.set_device_filter(device_filter)
+        self.assertEqual(listed, [device_filter])
+        self.assertEqual([device.path for device in aggregated.devices], ['/dev/input/by-id/kbd-b-event-kbd'])
+        self.assertEqual(aggregated.device_filter, device_filter)
+
+    def test_set_device_filter_unlisted(self):
+        aggregated = self.aggregate()
+        with self.assertRaises(NotImplementedError):
+            aggregated.set_device_filter(lambda info: True)
+        self.assertEqual(len(aggregated.devices), 2)
+
+if __name__ == '__main__':
+    unittest.main()
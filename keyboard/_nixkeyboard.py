@@ -1,14 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
 import struct
 import traceback
-from time import time as now
+import time as _time
 from collections import namedtuple
-from ._keyboard_event import KeyboardEvent, KEY_DOWN, KEY_UP
+from ._keyboard_event import KeyboardEvent, KEY_DOWN, KEY_UP, intern_name, REPEAT_PASS, REPEAT_DROP, REPEAT_SINGLE
 from ._canonical_names import all_modifiers, normalize_name
-from ._nixcommon import EV_KEY, aggregate_devices
-
-# TODO: start by reading current keyboard state, as to not missing any already pressed keys.
-# See: http://stackoverflow.com/questions/3649874/how-to-get-keyboard-state-in-linux
+from ._nixcommon import EV_KEY, EV_SYN, SYN_REPORT, SYN_DROPPED, CLOCK_REALTIME, CLOCK_MONOTONIC, aggregate_devices, device_filters, make_device_filter
 
 def cleanup_key(name):
     """ Formats a dumpkeys format to our standard. """
@@ -59,35 +57,31 @@ def register_key(key_and_modifiers, name):
     if key_and_modifiers not in from_name[name]:
         from_name[name].append(key_and_modifiers)
 
-def build_tables():
-    if to_name and from_name: return
-
-    modifiers_bits = {
-        'shift': 1,
-        'alt gr': 2,
-        'ctrl': 4,
-        'alt': 8,
-    }
-    keycode_template = r'^keycode\s+(\d+)\s+=(.*?)$'
-    try:
-        dump = check_output(['dumpkeys', '--keys-only'], universal_newlines=True)
-    except CalledProcessError as e:
-        if e.returncode == 1:
-            raise ValueError('Failed to run dumpkeys to get key names. Check if your user is part of the "tty" group, and if not, add it with "sudo usermod -a -G tty USER".')
-        else:
-            raise
-
-
-    for str_scan_code, str_names in re.findall(keycode_template, dump, re.MULTILINE):
-        scan_code = int(str_scan_code)
-        for i, str_name in enumerate(str_names.strip().split()):
-            modifiers = tuple(sorted(modifier for modifier, bit in modifiers_bits.items() if i & bit))
-            name, is_keypad = cleanup_key(str_name)
-            register_key((scan_code, modifiers), name)
-            if is_keypad:
-                keypad_scan_codes.add(scan_code)
-                register_key((scan_code, modifiers), 'keypad ' + name)
+modifiers_bits = {
+    'shift': 1,
+    'alt gr': 2,
+    'ctrl': 4,
+    'alt': 8,
+}
+
+def register_keymap_entry(scan_code, keymap_index, str_name):
+    """ Registers a dumpkeys-style name found in the given keymap column. """
+    modifiers = tuple(sorted(modifier for modifier, bit in modifiers_bits.items() if keymap_index & bit))
+    name, is_keypad = cleanup_key(str_name)
+    register_key((scan_code, modifiers), name)
+    if is_keypad:
+        keypad_scan_codes.add(scan_code)
+        register_key((scan_code, modifiers), 'keypad ' + name)
+
+def register_synonyms(synonyms):
+    for synonym_str, original_str in synonyms:
+        synonym, _ = cleanup_key(synonym_str)
+        original, _ = cleanup_key(original_str)
+        if synonym != original:
+            from_name[original].extend(from_name[synonym])
+            from_name[synonym].extend(from_name[original])
 
+def fix_special_keys():
     # dumpkeys consistently misreports the Windows key, sometimes
     # skipping it completely or reporting as 'alt. 125 = left win,
     # 126 = right win.
@@ -106,14 +100,226 @@ def build_tables():
     if (127, ()) not in to_name:
         register_key((127, ()), 'menu')
 
+# Set to False to always use dumpkeys instead of reading the console keymap
+# directly.
+use_kernel_keymap = True
+
+def build_tables():
+    if to_name and from_name: return
+    try:
+        if not use_kernel_keymap:
+            raise IOError('Kernel keymap disabled.')
+        keysyms = read_kernel_keymap()
+    except (IOError, OSError):
+        build_tables_from_dumpkeys()
+        return
+    if load_tables_cache(keysyms): return
+    build_tables_from_kernel(keysyms)
+    save_tables_cache(keysyms)
+
+def build_tables_from_dumpkeys():
+    keycode_template = r'^keycode\s+(\d+)\s+=(.*?)$'
+    try:
+        dump = check_output(['dumpkeys', '--keys-only'], universal_newlines=True)
+    except CalledProcessError as e:
+        if e.returncode == 1:
+            raise ValueError('Failed to run dumpkeys to get key names. Check if your user is part of the "tty" group, and if not, add it with "sudo usermod -a -G tty USER".')
+        else:
+            raise
+
+
+    for str_scan_code, str_names in re.findall(keycode_template, dump, re.MULTILINE):
+        scan_code = int(str_scan_code)
+        for i, str_name in enumerate(str_names.strip().split()):
+            register_keymap_entry(scan_code, i, str_name)
+
+    fix_special_keys()
+
     synonyms_template = r'^(\S+)\s+for (.+)$'
     dump = check_output(['dumpkeys', '--long-info'], universal_newlines=True)
-    for synonym_str, original_str in re.findall(synonyms_template, dump, re.MULTILINE):
-        synonym, _ = cleanup_key(synonym_str)
-        original, _ = cleanup_key(original_str)
-        if synonym != original:
-            from_name[original].extend(from_name[synonym])
-            from_name[synonym].extend(from_name[original])
+    register_synonyms(re.findall(synonyms_template, dump, re.MULTILINE))
+
+"""
+The same tables can be built without dumpkeys, by asking the kernel for each
+entry of the console keymap with the KDGKBENT ioctl and naming the keysyms
+like dumpkeys does. This requires access to a console, same as dumpkeys, but
+avoids spawning two processes.
+"""
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+KDGKBTYPE = 0x4B33
+KDGKBENT = 0x4B46
+NR_KEYS = 256
+# Only the keymaps combining shift, alt gr, ctrl and alt are used.
+NR_KEYMAPS = 16
+kbentry = struct.Struct('BBH')
+
+# Keysym names by type, from the kernel's include/uapi/linux/keyboard.h and
+# the kbd project's ksyms.c.
+KT_LATIN, KT_FN, KT_SPEC, KT_PAD, KT_DEAD, KT_CONS, KT_CUR, KT_SHIFT, KT_META, KT_ASCII, KT_LOCK, KT_LETTER, KT_SLOCK = range(13)
+NR_TYPES = 15
+K_HOLE = (KT_SPEC << 8) | 0
+K_NOSUCHMAP = (KT_SPEC << 8) | 127
+fn_syms = ['F{}'.format(i) for i in range(1, 21)] + ['Find', 'Insert', 'Remove', 'Select', 'Prior', 'Next', 'Macro', 'Help', 'Do', 'Pause']
+spec_syms = ['VoidSymbol', 'Return', 'Show_Registers', 'Show_Memory', 'Show_State', 'Send_Break', 'Last_Console', 'Caps_Lock', 'Num_Lock', 'Scroll_Lock', 'Scroll_Forward', 'Scroll_Backward', 'Boot', 'Caps_On', 'Compose', 'SAK', 'Decr_Console', 'Incr_Console', 'KeyboardSignal', 'Bare_Num_Lock']
+pad_syms = ['KP_{}'.format(i) for i in range(10)] + ['KP_Add', 'KP_Subtract', 'KP_Multiply', 'KP_Divide', 'KP_Enter', 'KP_Comma', 'KP_Period', 'KP_MinPlus']
+dead_syms = ['dead_grave', 'dead_acute', 'dead_circumflex', 'dead_tilde', 'dead_diaeresis', 'dead_cedilla']
+cur_syms = ['Down', 'Left', 'Right', 'Up']
+shift_syms = ['Shift', 'AltGr', 'Control', 'Alt', 'ShiftL', 'ShiftR', 'CtrlL', 'CtrlR', 'CapsShift']
+latin_control_syms = {0: 'nul', 8: 'BackSpace', 9: 'Tab', 10: 'Linefeed', 27: 'Escape', 32: 'space', 43: 'plus', 127: 'Delete'}
+# The synonyms reported by `dumpkeys --long-info` that matter for key names.
+kernel_synonyms = [('Home', 'Find'), ('End', 'Select'), ('PageUp', 'Prior'), ('PageDown', 'Next'), ('Control_h', 'BackSpace'), ('Control_i', 'Tab'), ('Control_j', 'Linefeed')]
+
+def latin_name(value):
+    if value in latin_control_syms:
+        return latin_control_syms[value]
+    elif value < 32:
+        return 'Control_' + chr(value + 64).lower()
+    return unichr(value)
+
+def keysym_name(keysym):
+    """
+    Returns the dumpkeys name of a keysym returned by KDGKBENT, or None if
+    it's not a key we care about.
+    """
+    if keysym in (K_HOLE, K_NOSUCHMAP):
+        return None
+    type, value = keysym >> 8, keysym & 0xff
+    if type >= NR_TYPES:
+        # Unicode entries are stored as the code point, and KDGKBENT returns
+        # them XOR'ed with 0xf000. See U() in include/uapi/linux/keyboard.h.
+        codepoint = keysym ^ 0xf000
+        return latin_name(codepoint) if codepoint < 256 else unichr(codepoint)
+    if type in (KT_LATIN, KT_LETTER):
+        return latin_name(value)
+    elif type == KT_META:
+        return 'Meta_' + latin_name(value)
+    elif type == KT_CONS:
+        return 'Console_{}'.format(value + 1)
+    elif type == KT_FN and value >= len(fn_syms):
+        return 'F{}'.format(value - 9)
+    elif type == KT_LOCK and value < len(shift_syms):
+        return shift_syms[value] + '_Lock'
+    elif type == KT_SLOCK and value < len(shift_syms):
+        return 'S' + shift_syms[value]
+    names = {KT_FN: fn_syms, KT_SPEC: spec_syms, KT_PAD: pad_syms, KT_DEAD: dead_syms, KT_CUR: cur_syms, KT_SHIFT: shift_syms}.get(type, [])
+    return names[value] if value < len(names) else None
+
+def open_console():
+    """
+    Returns a file descriptor for a virtual console, same as `getfd` in kbd.
+    Raises IOError if none is accessible.
+    """
+    import fcntl
+    for path in ['/proc/self/fd/0', '/dev/tty', '/dev/tty0', '/dev/vc/0', '/dev/console']:
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_NOCTTY)
+        except (IOError, OSError):
+            continue
+        try:
+            fcntl.ioctl(fd, KDGKBTYPE, b'\0')
+            return fd
+        except (IOError, OSError):
+            os.close(fd)
+    raise IOError('Failed to open a console to read the keymap.')
+
+def read_kernel_keymap():
+    """
+    Reads the keysyms of every key in every keymap of the console, as a
+    list indexed by `scan_code * NR_KEYMAPS + keymap_index`.
+    """
+    import fcntl
+    console = open_console()
+    try:
+        keysyms = []
+        for scan_code in range(NR_KEYS):
+            for keymap_index in range(NR_KEYMAPS):
+                entry = fcntl.ioctl(console, KDGKBENT, kbentry.pack(keymap_index, scan_code, 0))
+                keysyms.append(kbentry.unpack(entry)[2])
+        return keysyms
+    finally:
+        os.close(console)
+
+def build_tables_from_kernel(keysyms):
+    for scan_code in range(NR_KEYS):
+        str_names = [keysym_name(keysym) for keysym in keysyms[scan_code * NR_KEYMAPS:(scan_code + 1) * NR_KEYMAPS]]
+        # dumpkeys collapses keys that are the same in every keymap.
+        if len(set(str_names)) == 1:
+            str_names = str_names[:1]
+        for keymap_index, str_name in enumerate(str_names):
+            if str_name:
+                register_keymap_entry(scan_code, keymap_index, str_name)
+
+    fix_special_keys()
+    register_synonyms(kernel_synonyms)
+
+"""
+Turning the console keymap into name tables takes time, so the resulting
+tables are cached in the user cache dir. The cache is keyed on the raw
+keymap read from the kernel, so it follows `loadkeys` and layout changes
+made by any means. When the keymap can't be read, dumpkeys is used and
+nothing is cached, since there would be no reliable key.
+"""
+import json
+import hashlib
+
+use_tables_cache = True
+# Increment when the table format or parsing changes.
+tables_cache_version = 3
+
+def get_tables_cache_path(keysyms):
+    key = hashlib.sha1(str(tables_cache_version).encode('utf-8'))
+    key.update(struct.pack('{}H'.format(len(keysyms)), *keysyms))
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'keyboard', 'nix_tables_{}.json'.format(key.hexdigest()[:16]))
+
+def load_tables_cache(keysyms):
+    """
+    Fills the name tables from the cache of this keymap, if available.
+    Returns True on success.
+    """
+    if not use_tables_cache:
+        return False
+    try:
+        with open(get_tables_cache_path(keysyms)) as f:
+            cache = json.load(f)
+        for scan_code, modifiers, names in cache['to_name']:
+            to_name[(scan_code, tuple(modifiers))] = names
+        for name, entries in cache['from_name']:
+            from_name[name] = [(scan_code, tuple(modifiers)) for scan_code, modifiers in entries]
+        keypad_scan_codes.update(cache['keypad_scan_codes'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        to_name.clear()
+        from_name.clear()
+        keypad_scan_codes.clear()
+        return False
+    return True
+
+def save_tables_cache(keysyms):
+    if not use_tables_cache:
+        return
+    cache = {
+        'to_name': [[scan_code, modifiers, names] for (scan_code, modifiers), names in to_name.items() if names],
+        'from_name': [[name, entries] for name, entries in from_name.items() if entries],
+        'keypad_scan_codes': sorted(keypad_scan_codes),
+    }
+    path = get_tables_cache_path(keysyms)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Write and rename, so concurrent processes never see a partial file.
+        temp_path = '{}.{}'.format(path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(cache, f, separators=(',', ':'))
+        os.rename(temp_path, path)
+    except (IOError, OSError):
+        pass
+
+# Clock of the event timestamps, also used for the events we synthesize.
+now = _time.time
 
 device = None
 def build_device():
@@ -124,38 +330,260 @@ def build_device():
 def init():
     build_device()
     build_tables()
+    # Listeners usually send keys too (suppression, remapping, hotkeys), and
+    # run long enough for other programs to open the new device meanwhile.
+    device.create_output()
 
-pressed_modifiers = set()
+"""
+To name each event without allocating, the tables above are flattened into a
+list indexed by `scan_code << 4 | keymap_mask`, where `keymap_mask` has the
+same bits as the keymap columns (`modifiers_bits`). Pressed modifiers are
+tracked as an int with one bit for each name in `all_modifiers`, the keymap
+ones using their keymap bit.
+"""
+modifier_bits = dict(modifiers_bits)
+for name in sorted(all_modifiers - set(modifier_bits)):
+    modifier_bits[name] = 1 << len(modifier_bits)
+KEYMAP_MASK = sum(modifiers_bits.values())
+NR_KEY_CODES = 0x300
+
+# (name, is_keypad, modifier bit) for each scan code and keymap modifiers.
+key_table = []
+def build_key_table():
+    if key_table: return
+    table = []
+    for scan_code in range(NR_KEY_CODES):
+        is_keypad = scan_code in keypad_scan_codes
+        default = to_name.get((scan_code, ()))
+        for keymap_mask in range(KEYMAP_MASK + 1):
+            modifiers = tuple(sorted(modifier for modifier, bit in modifiers_bits.items() if keymap_mask & bit))
+            names = to_name.get((scan_code, modifiers)) or default or ['unknown']
+            # Normalized here once, so events can be built without it.
+            name = intern_name(normalize_name(names[0]))
+            table.append((name, is_keypad, modifier_bits.get(name, 0)))
+    key_table[:] = table
+
+unknown_key = ('unknown', False, 0)
+pressed_modifiers = 0
+pressed_modifiers_tuple = ()
+# Sorted tuple of modifier names for each `pressed_modifiers` value.
+modifiers_tuples = {0: ()}
+
+# (scan_code, device_id) of keys held down, as seen by the listener. Used to
+# resynchronize with the kernel after events are dropped.
+pressed_keys = set()
+# Number of times the kernel reported its event buffer overflowed
+# (SYN_DROPPED) because we didn't read fast enough.
+syn_dropped_count = 0
+
+# Autorepeats (evdev value 2) received for each held key, by
+# (scan_code, device_id).
+repeat_counts = {}
+repeat_policy = REPEAT_PASS
+
+def set_repeat_policy(policy):
+    """
+    Chooses how autorepeat events are reported: all of them (REPEAT_PASS),
+    none (REPEAT_DROP), or only the first one of each key press
+    (REPEAT_SINGLE). Unreported repeats still reach other programs.
+    """
+    global repeat_policy
+    repeat_policy = policy
+
+def to_event(event_type, scan_code, time, device_id, is_repeat=False, repeat_count=0):
+    """
+    Builds a KeyboardEvent, naming the key according to the modifiers
+    currently pressed, and updates `pressed_modifiers`.
+    """
+    global pressed_modifiers, pressed_modifiers_tuple
+    modifiers = pressed_modifiers_tuple
+    if scan_code < NR_KEY_CODES:
+        name, is_keypad, bit = key_table[scan_code << 4 | pressed_modifiers & KEYMAP_MASK]
+    else:
+        name, is_keypad, bit = unknown_key
+
+    if bit:
+        if event_type == KEY_DOWN:
+            pressed_modifiers |= bit
+        else:
+            pressed_modifiers &= ~bit
+        pressed_modifiers_tuple = modifiers_tuples.get(pressed_modifiers)
+        if pressed_modifiers_tuple is None:
+            pressed_modifiers_tuple = modifiers_tuples[pressed_modifiers] = tuple(sorted(name for name, bit in modifier_bits.items() if pressed_modifiers & bit))
+
+    return KeyboardEvent.trusted(event_type, scan_code, name, time, device_id, modifiers, is_keypad, is_repeat, repeat_count)
+
+def get_pressed_events():
+    """
+    Reads the current state of all keyboards, returning a KEY_DOWN event for
+    each key already held down, and resets `pressed_modifiers` to match.
+    """
+    global pressed_modifiers, pressed_modifiers_tuple
+    build_device()
+    build_tables()
+    build_key_table()
+
+    pressed_modifiers = 0
+    pressed_modifiers_tuple = ()
+    time = now()
+    current = device.get_pressed_keys()
+    repeat_counts.clear()
+    pressed_keys.clear()
+    pressed_keys.update(current)
+    # Modifiers first, so the other keys are named accordingly.
+    is_modifier = lambda scan_code: scan_code < NR_KEY_CODES and key_table[scan_code << 4][2]
+    current.sort(key=lambda key: not is_modifier(key[0]))
+    return [to_event(KEY_DOWN, scan_code, time, device_id) for scan_code, device_id in current]
+
+def resync(time):
+    """
+    Compares the keys we believe are pressed with the kernel state, returning
+    synthetic events for the differences. Used after events were dropped.
+    """
+    current = set(device.get_pressed_keys())
+    released = sorted(pressed_keys - current)
+    pressed = sorted(current - pressed_keys)
+    pressed_keys.clear()
+    pressed_keys.update(current)
+    for key in released:
+        repeat_counts.pop(key, None)
+    return [to_event(KEY_UP, scan_code, time, device_id) for scan_code, device_id in released] + [to_event(KEY_DOWN, scan_code, time, device_id) for scan_code, device_id in pressed]
 
 def listen(callback):
+    global syn_dropped_count
     build_device()
     build_tables()
-
-    while True:
-        time, type, code, value, device_id = device.read_event()
-        if type != EV_KEY:
-            continue
-
-        scan_code = code
-        event_type = KEY_DOWN if value else KEY_UP # 0 = UP, 1 = DOWN, 2 = HOLD
-
-        pressed_modifiers_tuple = tuple(sorted(pressed_modifiers))
-        names = to_name[(scan_code, pressed_modifiers_tuple)] or to_name[(scan_code, ())] or ['unknown']
-        name = names[0]
-            
-        if name in all_modifiers:
-            if event_type == KEY_DOWN:
-                pressed_modifiers.add(name)
-            else:
-                pressed_modifiers.discard(name)
-
-        is_keypad = scan_code in keypad_scan_codes
-        callback(KeyboardEvent(event_type=event_type, scan_code=scan_code, name=name, time=time, device=device_id, is_keypad=is_keypad, modifiers=pressed_modifiers_tuple))
+    build_key_table()
+
+    def process(event, value):
+        # When grabbing, nobody else sees the original event, so we re-send
+        # the accepted ones through the uinput device. A failing hook must
+        # not swallow the key, or kill the listener while keyboards are
+        # grabbed.
+        try:
+            accept = callback(event)
+        except Exception:
+            traceback.print_exc()
+            accept = True
+        if accept and resends(event.device):
+            device.write_event(EV_KEY, event.scan_code, value)
+
+    # Devices grabbed while handling the current read. The rest of its events
+    # were already delivered to other programs, and must not be re-sent.
+    newly_grabbed = set()
+    def resends(device_id):
+        return device_id in device.grabbed and device_id not in newly_grabbed
+
+    # Devices whose events are being discarded until the next SYN_REPORT.
+    dropping = set()
+    try:
+        while True:
+            events = device.read_events()
+            newly_grabbed.clear()
+            # Keeps re-sent events in the same frame as the original ones.
+            with device.batch() as batch:
+                for time, type, code, value, device_id in events:
+                    if type == EV_SYN:
+                        if code == SYN_DROPPED:
+                            syn_dropped_count += 1
+                            dropping.add(device_id)
+                        elif code == SYN_REPORT:
+                            if dropping and device_id in dropping:
+                                dropping.discard(device_id)
+                                for event in resync(time):
+                                    process(event, int(event.event_type == KEY_DOWN))
+                            if device.grab:
+                                batch.flush()
+                                if device_id not in device.grabbed:
+                                    device.try_grab(device_id)
+                                    if device_id in device.grabbed:
+                                        newly_grabbed.add(device_id)
+                        continue
+                    if type != EV_KEY or (dropping and device_id in dropping):
+                        continue
+                    if device.grab and device_id == device.output.path:
+                        # Events we re-sent ourselves.
+                        continue
+
+                    # 0 = UP, 1 = DOWN, 2 = HOLD (autorepeat)
+                    key = (code, device_id)
+                    if value == 2:
+                        count = repeat_counts[key] = repeat_counts.get(key, 0) + 1
+                        if repeat_policy == REPEAT_DROP or (repeat_policy == REPEAT_SINGLE and count > 1):
+                            if resends(device_id):
+                                device.write_event(EV_KEY, code, value)
+                            continue
+                        event = to_event(KEY_DOWN, code, time, device_id, True, count)
+                    elif value:
+                        pressed_keys.add(key)
+                        repeat_counts[key] = 0
+                        event = to_event(KEY_DOWN, code, time, device_id)
+                    else:
+                        pressed_keys.discard(key)
+                        # The release tells how many times the key repeated.
+                        event = to_event(KEY_UP, code, time, device_id, False, repeat_counts.pop(key, 0))
+                    process(event, value)
+    finally:
+        # Nobody would re-send the events of keyboards left grabbed.
+        if device.grabbed:
+            device.set_grab(False)
+
+def set_device_filter(include=None, exclude=None, keyboards_only=True):
+    """
+    Chooses which keyboards are listened to. See `make_device_filter`.
+    """
+    device_filter = make_device_filter(include, exclude, keyboards_only)
+    device_filters['kbd'] = device_filter
+    if device:
+        device.set_device_filter(device_filter)
+
+def set_monotonic_clock(enabled):
+    """
+    Timestamps events with CLOCK_MONOTONIC (EVIOCSCLOCKID), the same clock as
+    `time.monotonic`, instead of the wall clock, which jumps and slews when
+    the system time is adjusted.
+    """
+    global now
+    monotonic = getattr(_time, 'monotonic', None)
+    # `keyboard` replaces a missing `time.monotonic` with `time.time`.
+    if enabled and monotonic in (None, _time.time):
+        raise NotImplementedError('Monotonic timestamps require time.monotonic (Python 3.3+).')
+    build_device()
+    device.set_clock(CLOCK_MONOTONIC if enabled else CLOCK_REALTIME)
+    now = monotonic if enabled else _time.time
+
+def set_grab(enabled):
+    """
+    Grabs all keyboards so that their events are only seen by us, re-sending
+    the accepted ones through the uinput device. This allows events to be
+    suppressed.
+    """
+    build_device()
+    device.set_grab(enabled)
+
+def add_device_listener(callback):
+    """
+    Invokes `callback(action, path)` when a keyboard is plugged in or removed,
+    with `action` being 'added' or 'removed' (`DEVICE_ADDED` and
+    `DEVICE_REMOVED` in _nixcommon). Returns a function that removes the
+    listener.
+    """
+    build_device()
+    device.device_listeners.append(callback)
+    return lambda: device.device_listeners.remove(callback)
 
 def write_event(scan_code, is_down):
     build_device()
     device.write_event(EV_KEY, scan_code, int(is_down))
 
+def batch():
+    """
+    Context manager that groups all key events sent inside it into a single
+    `write` call to the output device.
+    """
+    build_device()
+    return device.batch()
+
 def map_name(name):
     build_tables()
     for entry in from_name[name]:
@@ -176,18 +604,19 @@ def type_unicode(character):
     codepoint = ord(character)
     hexadecimal = hex(codepoint)[len('0x'):]
 
-    for key in ['ctrl', 'shift', 'u']:
-        scan_code, _ = next(map_name(key))
-        press(scan_code)
+    with batch():
+        for key in ['ctrl', 'shift', 'u']:
+            scan_code, _ = next(map_name(key))
+            press(scan_code)
 
-    for key in hexadecimal:
-        scan_code, _ = next(map_name(key))
-        press(scan_code)
-        release(scan_code)
+        for key in hexadecimal:
+            scan_code, _ = next(map_name(key))
+            press(scan_code)
+            release(scan_code)
 
-    for key in ['ctrl', 'shift', 'u']:
-        scan_code, _ = next(map_name(key))
-        release(scan_code)
+        for key in ['ctrl', 'shift', 'u']:
+            scan_code, _ = next(map_name(key))
+            release(scan_code)
 
 if __name__ == '__main__':
     def p(e):
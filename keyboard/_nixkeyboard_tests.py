@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the Linux backend. The aggregated evdev device is replaced by a
+fake one that returns canned batches of raw events, and the key tables are
+filled with a few keys, so no device or console is needed.
+"""
+import sys
+import unittest
+import importlib
+
+# `_keyboard_tests` replaces functions of the backend module with mocks, so
+# these tests load their own copy of it.
+_module_name = __package__ + '._nixkeyboard'
+_shared = sys.modules.pop(_module_name, None)
+_nixkeyboard = importlib.import_module(_module_name)
+if _shared is not None:
+    sys.modules[_module_name] = _shared
+    setattr(sys.modules[__package__], '_nixkeyboard', _shared)
+
+from ._nixcommon import EV_KEY, EV_SYN, SYN_REPORT, SYN_DROPPED
+from ._keyboard_event import KEY_DOWN, KEY_UP
+
+KEY_A, KEY_B, KEY_LEFTSHIFT = 30, 48, 42
+
+class StopListening(Exception): pass
+
+class FakeBatch(object):
+    def __init__(self, device):
+        self.device = device
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.flush()
+    def flush(self):
+        self.device.written.append('flush')
+
+class FakeOutput(object):
+    path = '/dev/input/event99'
+
+class FakeDevice(object):
+    def __init__(self, batches, pressed=()):
+        self.batches = list(batches)
+        self.pressed = list(pressed)
+        self.grab = False
+        self.grabbed = set()
+        self.output = FakeOutput()
+        self.written = []
+
+    def read_events(self):
+        if not self.batches:
+            raise StopListening()
+        return self.batches.pop(0)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def write_event(self, type, code, value):
+        self.written.append((type, code, value))
+
+    def get_pressed_keys(self):
+        return list(self.pressed)
+
+    def try_grab(self, path):
+        self.grabbed.add(path)
+
+    def set_grab(self, enabled):
+        self.grab = enabled
+        if not enabled:
+            self.grabbed.clear()
+
+def key(code, value, device_id='kbd', time=1.0):
+    return (time, EV_KEY, code, value, device_id)
+
+def syn(code=SYN_REPORT, device_id='kbd', time=1.0):
+    return (time, EV_SYN, code, 0, device_id)
+
+class TestNixKeyboard(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict((name, getattr(_nixkeyboard, name)) for name in ['device', 'repeat_policy', 'syn_dropped_count'])
+        for table in [_nixkeyboard.to_name, _nixkeyboard.from_name]:
+            self.addCleanup(table.update, dict(table))
+            self.addCleanup(table.clear)
+            table.clear()
+        self.addCleanup(_nixkeyboard.key_table.__setitem__, slice(None), list(_nixkeyboard.key_table))
+        del _nixkeyboard.key_table[:]
+        for scan_code, name in [(KEY_A, 'a'), (KEY_B, 'b'), (KEY_LEFTSHIFT, 'shift')]:
+            _nixkeyboard.register_key((scan_code, ()), name)
+        _nixkeyboard.register_key((KEY_A, ('shift',)), 'A')
+        _nixkeyboard.pressed_keys.clear()
+        _nixkeyboard.repeat_counts.clear()
+        _nixkeyboard.pressed_modifiers = 0
+        _nixkeyboard.pressed_modifiers_tuple = ()
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(_nixkeyboard, name, value)
+        _nixkeyboard.pressed_keys.clear()
+        _nixkeyboard.repeat_counts.clear()
+
+    def listen(self, batches, callback=lambda e: True, pressed=(), grab=False, grabbed=('kbd',)):
+        """ Runs the listener over these batches of raw events. """
+        device = _nixkeyboard.device = FakeDevice(batches, pressed)
+        if grab:
+            device.grab = True
+            device.grabbed.update(grabbed)
+        events = []
+        def record(event):
+            events.append(event)
+            return callback(event)
+        with self.assertRaises(StopListening):
+            _nixkeyboard.listen(record)
+        return events, device
+
+    def test_listen(self):
+        events, device = self.listen([[key(KEY_LEFTSHIFT, 1), key(KEY_A, 1), syn(), key(KEY_A, 0), key(KEY_LEFTSHIFT, 0), syn()]])
+        self.assertEqual([(e.event_type, e.name) for e in events], [(KEY_DOWN, 'shift'), (KEY_DOWN, 'A'), (KEY_UP, 'A'), (KEY_UP, 'shift')])
+        self.assertEqual(events[1].modifiers, ('shift',))
+        self.assertEqual(_nixkeyboard.pressed_keys, set())
+
+    def test_grab_resends_accepted(self):
+        events, device = self.listen([[key(KEY_A, 1), key(KEY_B, 1), syn()]], callback=lambda e: e.scan_code == KEY_A, grab=True)
+        self.assertEqual(device.written[0], (EV_KEY, KEY_A, 1))
+        self.assertNotIn((EV_KEY, KEY_B, 1), device.written)
+
+    def test_grab_callback_error_resends(self):
+        def fail(event):
+            raise ValueError()
+        print_exc = _nixkeyboard.traceback.print_exc
+        _nixkeyboard.traceback.print_exc = lambda: None
+        try:
+            events, device = self.listen([[key(KEY_A, 1), syn()], [key(KEY_A, 0), syn()]], callback=fail, grab=True)
+        finally:
+            _nixkeyboard.traceback.print_exc = print_exc
+        # Both events are re-sent and the listener kept reading.
+        self.assertEqual(len(events), 2)
+        self.assertIn((EV_KEY, KEY_A, 1), device.written)
+        self.assertIn((EV_KEY, KEY_A, 0), device.written)
+
+    def test_grab_resends_from_next_read(self):
+        batches = [
+            # Grabbed at the first SYN_REPORT, but the rest of this read was
+            # already seen by other programs.
+            [key(KEY_A, 1), syn(), key(KEY_A, 0), syn(), key(KEY_B, 1), key(KEY_B, 2), syn()],
+            [key(KEY_B, 0), syn()],
+        ]
+        _nixkeyboard.set_repeat_policy(_nixkeyboard.REPEAT_DROP)
+        events, device = self.listen(batches, grab=True, grabbed=())
+        self.assertEqual(len(events), 4)
+        self.assertEqual([e for e in device.written if e != 'flush'], [(EV_KEY, KEY_B, 0)])
+
+    def test_grab_released_when_listener_stops(self):
+        events, device = self.listen([[key(KEY_A, 1), syn()]], grab=True)
+        self.assertFalse(device.grab)
+        self.assertEqual(device.grabbed, set())
+
+    def test_syn_dropped_resync(self):
+        _nixkeyboard.syn_dropped_count = 0
+        batches = [
+            [key(KEY_B, 1), syn()],
+            # Everything up to the next SYN_REPORT is incomplete.
+            [syn(SYN_DROPPED), key(KEY_A, 1), key(KEY_B, 0), key(KEY_B, 1, device_id='other')],
+            [syn()],
+            [key(KEY_A, 0), syn()],
+        ]
+        events, device = self.listen(batches, pressed=[(KEY_A, 'kbd'), (KEY_B, 'other')])
+        self.assertEqual([(e.event_type, e.scan_code, e.device) for e in events], [
+            (KEY_DOWN, KEY_B, 'kbd'),
+            # Other devices are not affected.
+            (KEY_DOWN, KEY_B, 'other'),
+            # Synthetic events from the kernel state, releases first.
+            (KEY_UP, KEY_B, 'kbd'),
+            (KEY_DOWN, KEY_A, 'kbd'),
+            (KEY_UP, KEY_A, 'kbd'),
+        ])
+        self.assertEqual(_nixkeyboard.syn_dropped_count, 1)
+        self.assertEqual(_nixkeyboard.pressed_keys, set([(KEY_B, 'other')]))
+
+    def test_syn_dropped_resync_grab(self):
+        events, device = self.listen([[syn(SYN_DROPPED), key(KEY_A, 1)], [syn()]], pressed=[(KEY_A, 'kbd')], grab=True)
+        self.assertEqual([(e.event_type, e.scan_code) for e in events], [(KEY_DOWN, KEY_A)])
+        # The synthetic press is re-sent like a real one, the dropped one isn't.
+        self.assertEqual(device.written.count((EV_KEY, KEY_A, 1)), 1)
+
+    def test_resync(self):
+        _nixkeyboard.build_key_table()
+        _nixkeyboard.device = FakeDevice([], pressed=[(KEY_A, 'kbd'), (KEY_LEFTSHIFT, 'kbd')])
+        _nixkeyboard.pressed_keys.update([(KEY_B, 'kbd'), (KEY_A, 'kbd')])
+        _nixkeyboard.repeat_counts[(KEY_B, 'kbd')] = 3
+        events = _nixkeyboard.resync(2.0)
+        self.assertEqual([(e.event_type, e.scan_code, e.time) for e in events], [(KEY_UP, KEY_B, 2.0), (KEY_DOWN, KEY_LEFTSHIFT, 2.0)])
+        self.assertEqual(_nixkeyboard.pressed_keys, set([(KEY_A, 'kbd'), (KEY_LEFTSHIFT, 'kbd')]))
+        self.assertEqual(_nixkeyboard.repeat_counts, {})
+        self.assertEqual(_nixkeyboard.resync(3.0), [])
+
+    def repeat(self, policy, grab=False):
+        _nixkeyboard.set_repeat_policy(policy)
+        batches = [[key(KEY_A, 1), syn()], [key(KEY_A, 2), syn()], [key(KEY_A, 2), syn()], [key(KEY_A, 2), syn()], [key(KEY_A, 0), syn()]]
+        events, device = self.listen(batches, grab=grab)
+        return [(e.event_type, e.is_repeat, e.repeat_count) for e in events], device
+
+    def test_repeat_pass(self):
+        events, device = self.repeat(_nixkeyboard.REPEAT_PASS)
+        self.assertEqual(events, [(KEY_DOWN, False, 0), (KEY_DOWN, True, 1), (KEY_DOWN, True, 2), (KEY_DOWN, True, 3), (KEY_UP, False, 3)])
+
+    def test_repeat_drop(self):
+        events, device = self.repeat(_nixkeyboard.REPEAT_DROP)
+        self.assertEqual(events, [(KEY_DOWN, False, 0), (KEY_UP, False, 3)])
+        self.assertEqual(_nixkeyboard.repeat_counts, {})
+
+    def test_repeat_single(self):
+        events, device = self.repeat(_nixkeyboard.REPEAT_SINGLE)
+        self.assertEqual(events, [(KEY_DOWN, False, 0), (KEY_DOWN, True, 1), (KEY_UP, False, 3)])
+
+    def test_repeat_count_reset(self):
+        batches = [[key(KEY_A, 1), key(KEY_A, 2), key(KEY_A, 0), syn()], [key(KEY_A, 1), key(KEY_A, 0), syn()]]
+        events, device = self.listen(batches)
+        self.assertEqual([e.repeat_count for e in events], [0, 1, 1, 0, 0])
+
+    def test_repeat_dropped_resent_when_grabbed(self):
+        events, device = self.repeat(_nixkeyboard.REPEAT_SINGLE, grab=True)
+        # Unreported repeats still reach other programs.
+        self.assertEqual([e for e in device.written if e != 'flush'], [(EV_KEY, KEY_A, 1), (EV_KEY, KEY_A, 2), (EV_KEY, KEY_A, 2), (EV_KEY, KEY_A, 2), (EV_KEY, KEY_A, 0)])
+
+    def test_repeat_dropped_not_resent_when_not_grabbed(self):
+        events, device = self.repeat(_nixkeyboard.REPEAT_DROP)
+        self.assertEqual([e for e in device.written if e != 'flush'], [])
+
+    def test_latin_name(self):
+        for value, name in [(0x61, 'a'), (0x20, 'space'), (0x7f, 'Delete'), (0x1b, 'Escape'), (0x01, 'Control_a'), (0x00, 'nul'), (0xe9, u'\xe9')]:
+            self.assertEqual(_nixkeyboard.latin_name(value), name)
+
+    def test_keysym_name(self):
+        table = [
+            (_nixkeyboard.K_HOLE, None),
+            (_nixkeyboard.K_NOSUCHMAP, None),
+            (0x0061, 'a'),                  # KT_LATIN
+            (0x0008, 'BackSpace'),
+            (0x0b61, 'a'),                  # KT_LETTER
+            (0x0100, 'F1'),                 # KT_FN
+            (0x0114, 'Find'),
+            (0x011e, 'F21'),
+            (0x0201, 'Return'),             # KT_SPEC
+            (0x02ff, None),
+            (0x0300, 'KP_0'),               # KT_PAD
+            (0x0310, 'KP_Period'),
+            (0x0401, 'dead_acute'),         # KT_DEAD
+            (0x0500, 'Console_1'),          # KT_CONS
+            (0x0603, 'Up'),                 # KT_CUR
+            (0x0700, 'Shift'),              # KT_SHIFT
+            (0x0702, 'Control'),
+            (0x0861, 'Meta_a'),             # KT_META
+            (0x0900, None),                 # KT_ASCII
+            (0x0a00, 'Shift_Lock'),         # KT_LOCK
+            (0x0a40, None),
+            (0x0c01, 'SAltGr'),             # KT_SLOCK
+            (0x0d00, None),                 # Unused types
+            # Unicode, XOR'ed with 0xf000.
+            (0xf061, 'a'),
+            (0xf01b, 'Escape'),
+            (0xf0e9, u'\xe9'),
+            (0x20ac ^ 0xf000, u'€'),
+        ]
+        for keysym, name in table:
+            self.assertEqual(_nixkeyboard.keysym_name(keysym), name, hex(keysym))
+
+    def test_tables_cache_keyed_on_keymap(self):
+        keymap = [0x61] * (_nixkeyboard.NR_KEYS * _nixkeyboard.NR_KEYMAPS)
+        other = list(keymap)
+        other[KEY_A * _nixkeyboard.NR_KEYMAPS] = 0x62
+        self.assertEqual(_nixkeyboard.get_tables_cache_path(keymap), _nixkeyboard.get_tables_cache_path(list(keymap)))
+        self.assertNotEqual(_nixkeyboard.get_tables_cache_path(keymap), _nixkeyboard.get_tables_cache_path(other))
+
+    def test_build_tables_cache(self):
+        import os, shutil, tempfile
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = cache_dir
+        def restore():
+            if old_cache_home is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = old_cache_home
+        self.addCleanup(restore)
+
+        size = _nixkeyboard.NR_KEYS * _nixkeyboard.NR_KEYMAPS
+        keymaps = {'a': [0x61] * size, 'b': [0x62] * size}
+        parsed = []
+        build_tables_from_kernel = _nixkeyboard.build_tables_from_kernel
+        def build(keysyms):
+            parsed.append(keysyms[0])
+            build_tables_from_kernel(keysyms)
+        _nixkeyboard.build_tables_from_kernel = build
+        self.addCleanup(setattr, _nixkeyboard, 'build_tables_from_kernel', build_tables_from_kernel)
+        self.addCleanup(setattr, _nixkeyboard, 'read_kernel_keymap', _nixkeyboard.read_kernel_keymap)
+
+        for layout in ['a', 'a', 'b', 'a']:
+            _nixkeyboard.to_name.clear()
+            _nixkeyboard.from_name.clear()
+            _nixkeyboard.read_kernel_keymap = lambda: keymaps[layout]
+            _nixkeyboard.build_tables()
+            self.assertEqual(_nixkeyboard.to_name[(KEY_A, ())], [layout])
+        # Parsed once per keymap, then loaded from the cache.
+        self.assertEqual(parsed, [0x61, 0x62])
+
+if __name__ == '__main__':
+    unittest.main()
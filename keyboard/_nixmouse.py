@@ -2,7 +2,7 @@
 import struct
 from subprocess import check_output
 import re
-from ._nixcommon import EV_KEY, EV_REL, EV_MSC, EV_SYN, EV_ABS, aggregate_devices
+from ._nixcommon import EV_KEY, EV_REL, EV_MSC, EV_SYN, EV_ABS, SYN_REPORT, SYN_DROPPED, aggregate_devices
 from ._mouse_event import ButtonEvent, WheelEvent, MoveEvent, LEFT, RIGHT, MIDDLE, X, X2, UP, DOWN
 
 import ctypes
@@ -34,8 +34,34 @@ def get_position():
                             byref(win_x), byref(win_y), byref(mask))
     return root_x.value, root_y.value
 
+# The listener reads the pointer position from the X server once for each
+# frame of motion. If `track_position` is set, the position is instead
+# estimated by adding up the relative motion, and only read again every
+# `position_resync_interval` seconds. This saves an X round trip per frame
+# with high rate mice, at the cost of ignoring pointer acceleration and screen
+# edges between re-syncs.
+track_position = False
+position_resync_interval = 0.1
+tracked_position = None
+last_position_resync = 0
+
+def update_position(dx, dy, time):
+    """ Returns the pointer position after a frame of relative motion. """
+    global tracked_position, last_position_resync
+    if not track_position:
+        return get_position()
+    if tracked_position is None or not 0 <= time - last_position_resync < position_resync_interval:
+        tracked_position = get_position()
+        last_position_resync = time
+    else:
+        x, y = tracked_position
+        tracked_position = (x + dx, y + dy)
+    return tracked_position
+
 def move_to(x, y):
+    global tracked_position
     build_display()
+    tracked_position = None
     x11.XWarpPointer(display, None, window, 0, 0, 0, 0, x, y)
     x11.XFlush(display)
 
@@ -69,35 +95,52 @@ def build_device():
     global device
     if device: return
     device = aggregate_devices('mouse')
-init = build_device
+
+def init():
+    build_device()
+    # Created with the listener, so it's ready by the time events are sent.
+    device.create_output()
 
 def listen(queue):
+    global tracked_position
     build_device()
 
+    # Relative motion of each device in the current frame, as [dx, dy]. It's
+    # reported as a single MoveEvent when the frame ends.
+    motion = {}
     while True:
-        time, type, code, value, device_id = device.read_event()
-        if type == EV_SYN or type == EV_MSC:
-            continue
-
-        event = None
-        arg = None
-
-        if type == EV_KEY:
-            event = ButtonEvent(DOWN if value else UP, button_by_code.get(code, '?'), time)
-        elif type == EV_REL:
-            value, = struct.unpack('i', struct.pack('I', value))
-
-            if code == REL_WHEEL:
-                event = WheelEvent(value, time)
-            elif code in (REL_X, REL_Y):
-                x, y = get_position()
-                event = MoveEvent(x, y, time)
-
-        if event is None:
-            # Unknown event type.
-            continue
-
-        queue.put(event)
+        for time, type, code, value, device_id in device.read_events():
+            if type == EV_SYN:
+                if code == SYN_REPORT and device_id in motion:
+                    dx, dy = motion.pop(device_id)
+                    x, y = update_position(dx, dy, time)
+                    queue.put(MoveEvent(x, y, time))
+                elif code == SYN_DROPPED:
+                    motion.pop(device_id, None)
+                    tracked_position = None
+                continue
+            if type == EV_MSC:
+                continue
+
+            event = None
+            arg = None
+
+            if type == EV_KEY:
+                event = ButtonEvent(DOWN if value else UP, button_by_code.get(code, '?'), time)
+            elif type == EV_REL:
+                value, = struct.unpack('i', struct.pack('I', value))
+
+                if code == REL_WHEEL:
+                    event = WheelEvent(value, time)
+                elif code in (REL_X, REL_Y):
+                    delta = motion.setdefault(device_id, [0, 0])
+                    delta[code == REL_Y] += value
+
+            if event is None:
+                # Unknown event type, or motion waiting for the end of the frame.
+                continue
+
+            queue.put(event)
 
 def press(button=LEFT):
     build_device()
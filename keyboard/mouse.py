@@ -183,7 +183,7 @@ def unhook_all():
     Removes all hooks registered by this application. Note this may include
     hooks installed by high level functions, such as `record`.
     """
-    del _listener.handlers[:]
+    _listener.remove_all_handlers()
 
 def record(button=RIGHT, target_types=(DOWN,)):
     """